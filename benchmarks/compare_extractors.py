@@ -0,0 +1,120 @@
+"""Checks that the XSLT extractor gives exactly the same rows as the Python extractor for every
+organisation in a data file, and times how long each of them takes to extract the organisations.
+
+    $ python benchmarks/compare_extractors.py --organisations 100000
+    $ python benchmarks/compare_extractors.py -x data/fullfile.zip
+"""
+import argparse
+import os
+import sys
+import time
+import zipfile
+
+# setup path so we can import the import tool itself
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT_PATH)
+
+from lxml import etree as xml_tree_parser
+
+from generate_ods_data import ODSDataGenerator
+from import_tool.controller.ODSDBCreator import extractors
+
+
+def read_organisations(data_file):
+    """Parses a data zip file, returning its Organisation elements and the codesystem display names by code"""
+    with zipfile.ZipFile(data_file) as data_zip:
+        with data_zip.open(data_zip.namelist()[0]) as data:
+            document = xml_tree_parser.parse(data)
+
+    code_system_dict = dict((concept.attrib.get('id'), concept.attrib.get('displayName'))
+                            for concept in document.iterfind('CodeSystems/CodeSystem/concept'))
+
+    return document.findall('Organisations/Organisation'), code_system_dict
+
+
+def extract_all(extract, organisations, code_system_dict):
+    """Extracts every organisation, returning the rows, or the error raised, of each one"""
+    extracted = []
+
+    for organisation_xml in organisations:
+        try:
+            extracted.append(extract(organisation_xml, code_system_dict))
+        except Exception as e:
+            extracted.append(repr(e))
+
+    return extracted
+
+
+def compare(organisations, code_system_dict):
+    """Returns the OrgIds of the organisations the extractors do not agree on, comparing the order
+    of the rows and of their keys as well as the values"""
+    python_rows = extract_all(extractors['python'], organisations, code_system_dict)
+    xslt_rows = extract_all(extractors['xslt'], organisations, code_system_dict)
+
+    differences = []
+
+    for organisation_xml, python_extracted, xslt_extracted in zip(organisations, python_rows, xslt_rows):
+        if python_extracted != xslt_extracted or \
+                [(table_name, list(row)) for table_name, row in python_extracted] != \
+                [(table_name, list(row)) for table_name, row in xslt_extracted]:
+            differences.append(organisation_xml.find('OrgId').attrib.get('extension'))
+
+    return differences
+
+
+def time_extractor(extract, organisations, code_system_dict, repeats):
+    """Returns the quickest time out of several runs, as the others have been slowed by something else"""
+    times = []
+
+    for repeat in range(repeats):
+        started = time.perf_counter()
+
+        for organisation_xml in organisations:
+            extract(organisation_xml, code_system_dict)
+
+        times.append(time.perf_counter() - started)
+
+    return min(times)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Compare the Python and XSLT extractors")
+
+    parser.add_argument("-x", "--xml", type=str,
+                        help="data zip file to compare them on, instead of generating one")
+    parser.add_argument("-n", "--organisations", type=int, default=10000,
+                        help="number of organisations to generate (defaults to 10000)")
+    parser.add_argument("--work_dir", type=str, default='data/benchmarks',
+                        help="directory to keep the generated data files in")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="number of times to time each extractor, the quickest is reported (defaults to 3)")
+
+    args = parser.parse_args()
+
+    if args.xml:
+        data_file = args.xml
+    else:
+        if not os.path.isdir(args.work_dir):
+            os.makedirs(args.work_dir)
+
+        data_file = os.path.join(args.work_dir, 'bench_%s.zip' % args.organisations)
+
+        if not os.path.isfile(data_file):
+            print("Generating %s organisations" % args.organisations)
+            ODSDataGenerator(args.organisations).write_zip(data_file)
+
+    organisations, code_system_dict = read_organisations(data_file)
+    print("Read %s organisations from %s" % (len(organisations), data_file))
+
+    differences = compare(organisations, code_system_dict)
+
+    if differences:
+        print("The extractors differ on %s organisations, e.g. %s" % (len(differences), ', '.join(differences[:10])))
+        sys.exit(1)
+
+    print("Both extractors give the same rows")
+
+    for name in sorted(extractors):
+        extract_time = time_extractor(extractors[name], organisations, code_system_dict, args.repeats)
+        print("  %-6s %.2fs, %.0f organisations/s" % (name, extract_time, len(organisations) / extract_time))
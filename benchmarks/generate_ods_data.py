@@ -0,0 +1,238 @@
+"""Writes synthetic HSCOrgRefData XML zip files of any size for benchmarking the import.
+
+The data follows the structure of the published ODS full file and validates against the
+HSCOrgRefData.xsd in this directory, which is written alongside it as an ancilliary zip.
+
+    $ python benchmarks/generate_ods_data.py --organisations 100000 -x data/bench_100k.zip -s data/bench_schema.zip
+"""
+import argparse
+import datetime
+import os.path
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+SCHEMA_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'HSCOrgRefData.xsd')
+
+NAMESPACE = 'http://refdata.hscic.gov.uk/org/v2-0-0'
+ORG_ID_ROOT = '2.16.840.1.113883.2.1.3.2.4.18.48'
+
+ROLES = [
+    ('RO76', 'GP PRACTICE'),
+    ('RO177', 'PRESCRIBING COST CENTRE'),
+    ('RO197', 'NHS TRUST'),
+    ('RO198', 'NHS TRUST SITE'),
+    ('RO98', 'CLINICAL COMMISSIONING GROUP'),
+    ('RO182', 'PHARMACY'),
+]
+
+RELATIONSHIPS = [
+    ('RE2', 'IS A SUB-DIVISION OF'),
+    ('RE4', 'IS COMMISSIONED BY'),
+    ('RE6', 'IS OPERATED BY'),
+]
+
+RECORD_CLASSES = [
+    ('RC1', 'HSCOrg'),
+    ('RC2', 'HSCSite'),
+]
+
+TOWNS = ['LEEDS', 'YORK', 'BRADFORD', 'WAKEFIELD', 'HARROGATE', 'HULL', 'SHEFFIELD', 'MANCHESTER']
+COUNTIES = ['WEST YORKSHIRE', 'NORTH YORKSHIRE', 'SOUTH YORKSHIRE', 'GREATER MANCHESTER']
+STREETS = ['HIGH STREET', 'STATION ROAD', 'CHURCH LANE', 'PARK AVENUE', 'MILL LANE']
+
+
+class ODSDataGenerator(object):
+    """Generates the organisations of a synthetic ODS full file
+
+    """
+
+    def __init__(self, organisations, roles=2, relationships=1, successors=1, addresses=1,
+                 inactive_fraction=0.2, seed=1):
+        self.organisations = organisations
+        self.roles = max(roles, 1)
+        self.relationships = relationships
+        self.successors = successors
+        self.addresses = addresses
+        self.inactive_fraction = inactive_fraction
+        self.random = random.Random(seed)
+
+        self.__unique_id = 0
+
+    def __next_unique_id(self):
+        self.__unique_id += 1
+        return self.__unique_id
+
+    @staticmethod
+    def odscode(index):
+        return 'Y%05X' % index
+
+    @staticmethod
+    def __date(date_type, start, end=None):
+        xml = '<Date><Type value="%s"/><Start value="%s"/>' % (date_type, start.isoformat())
+        if end is not None:
+            xml += '<End value="%s"/>' % end.isoformat()
+        return xml + '</Date>'
+
+    def __random_date(self, first_year=1974, last_year=2017):
+        return datetime.date(self.random.randint(first_year, last_year),
+                             self.random.randint(1, 12), self.random.randint(1, 28))
+
+    @staticmethod
+    def __org_id(odscode):
+        return '<OrgId root="%s" assigningAuthorityName="HSCIC" extension="%s"/>' % (ORG_ID_ROOT, odscode)
+
+    def __target(self, odscode):
+        return '<Target>%s<PrimaryRoleId id="%s" uniqueRoleId="%s"/></Target>' % (
+            self.__org_id(odscode), self.random.choice(ROLES)[0], self.__next_unique_id())
+
+    def header(self, publication_seqno=1):
+        """Returns the document up to and including the opening Organisations tag"""
+        parts = [
+            '<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<HSCOrgRefData:OrgRefData xmlns:HSCOrgRefData="%s">\n' % NAMESPACE,
+            '<Manifest>',
+            '<Version value="2-0-0"/>',
+            '<PublicationType value="Full"/>',
+            '<PublicationSource value="HSCOrgRefData"/>',
+            '<PublicationDate value="%s"/>' % datetime.date.today().isoformat(),
+            '<PublicationSeqNum value="%s"/>' % publication_seqno,
+            '<FileCreationDateTime value="%s"/>' % datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            '<RecordCount value="%s"/>' % self.organisations,
+            '<ContentDescription value="FullFile"/>',
+            '<PrimaryRoleScope>',
+        ]
+        parts.extend('<PrimaryRole id="%s" displayName="%s"/>' % role for role in ROLES)
+        parts.append('</PrimaryRoleScope></Manifest>\n<CodeSystems>')
+
+        for name, oid, concepts in (('OrganisationRelationship', '2.16.840.1.113883.2.1.3.2.4.17.508', RELATIONSHIPS),
+                                    ('OrganisationRecordClass', '2.16.840.1.113883.2.1.3.2.4.17.507', RECORD_CLASSES),
+                                    ('OrganisationRole', '2.16.840.1.113883.2.1.3.2.4.17.506', ROLES)):
+            parts.append('<CodeSystem name="%s" oid="%s">' % (name, oid))
+            parts.extend('<concept id="%s" code="%s" displayName="%s"/>' % (concept_id, concept_id[2:], display_name)
+                         for concept_id, display_name in concepts)
+            parts.append('</CodeSystem>')
+
+        parts.append('</CodeSystems>\n<Organisations>\n')
+        return ''.join(parts)
+
+    @staticmethod
+    def footer():
+        return '</Organisations>\n</HSCOrgRefData:OrgRefData>\n'
+
+    def organisation(self, index):
+        """Returns the xml of a single Organisation element"""
+        random_generator = self.random
+        odscode = self.odscode(index)
+        active = random_generator.random() >= self.inactive_fraction
+        start = self.__random_date(1974, 2000)
+        end = None if active else self.__random_date(2001, 2017)
+
+        parts = ['<Organisation orgRecordClass="%s"%s>' % (
+            random_generator.choice(RECORD_CLASSES)[0],
+            ' refOnly="true"' if random_generator.random() < 0.02 else '')]
+        parts.append('<Name>%s</Name>' % escape('%s & %s MEDICAL CENTRE %s' % (
+            random_generator.choice(STREETS), random_generator.choice(TOWNS), index)))
+        parts.append(self.__date('Operational', start, end))
+        if random_generator.random() < 0.5:
+            parts.append(self.__date('Legal', start, end))
+        parts.append(self.__org_id(odscode))
+        parts.append('<Status value="%s"/>' % ('Active' if active else 'Inactive'))
+        parts.append('<LastChangeDate value="%s"/>' % self.__random_date(2010, 2017).isoformat())
+
+        if self.addresses:
+            parts.append('<GeoLoc>')
+            for _ in range(self.addresses):
+                town = random_generator.choice(TOWNS)
+                parts.append('<Location><AddrLn1>%s %s</AddrLn1>' % (
+                    random_generator.randint(1, 300), random_generator.choice(STREETS)))
+                if random_generator.random() < 0.5:
+                    parts.append('<AddrLn2>UNIT %s</AddrLn2>' % random_generator.randint(1, 20))
+                parts.append('<Town>%s</Town><County>%s</County><PostCode>%s%s %s%s</PostCode>'
+                             '<Country>ENGLAND</Country></Location>' % (
+                                 town, random_generator.choice(COUNTIES), town[:2], random_generator.randint(1, 30),
+                                 random_generator.randint(1, 9), random_generator.choice(['AB', 'XY', 'QT', 'LN'])))
+            parts.append('</GeoLoc>')
+
+        parts.append('<Roles>')
+        for role_index in range(self.roles):
+            parts.append('<Role id="%s" uniqueRoleId="%s"%s>%s<Status value="%s"/></Role>' % (
+                random_generator.choice(ROLES)[0], self.__next_unique_id(),
+                ' primaryRole="true"' if role_index == 0 else '',
+                self.__date('Operational', start, end), 'Active' if active else 'Inactive'))
+        parts.append('</Roles>')
+
+        # Relationships and successors point at earlier organisations, as parents usually come first
+        if self.relationships and index > 0:
+            parts.append('<Rels>')
+            for _ in range(self.relationships):
+                parts.append('<Rel id="%s" uniqueRelId="%s">%s<Status value="%s"/>%s</Rel>' % (
+                    random_generator.choice(RELATIONSHIPS)[0], self.__next_unique_id(),
+                    self.__date('Operational', self.__random_date(2000, 2017)),
+                    random_generator.choice(['Active', 'Active', 'Inactive']),
+                    self.__target(self.odscode(random_generator.randrange(index)))))
+            parts.append('</Rels>')
+
+        if self.successors and not active and index > 0:
+            parts.append('<Succs>')
+            for _ in range(self.successors):
+                parts.append('<Succ uniqueSuccId="%s">%s<Type>Successor</Type>%s</Succ>' % (
+                    self.__next_unique_id(), self.__date('Legal', end),
+                    self.__target(self.odscode(random_generator.randrange(index)))))
+            parts.append('</Succs>')
+
+        parts.append('</Organisation>\n')
+        return ''.join(parts)
+
+    def write_zip(self, data_file_path, publication_seqno=1):
+        """Writes the whole document into a zip file one organisation at a time"""
+        with zipfile.ZipFile(data_file_path, 'w', zipfile.ZIP_DEFLATED) as data_zip:
+            with data_zip.open('HSCOrgRefData_Full.xml', 'w', force_zip64=True) as data_file:
+                data_file.write(self.header(publication_seqno).encode('utf-8'))
+
+                for index in range(self.organisations):
+                    data_file.write(self.organisation(index).encode('utf-8'))
+
+                data_file.write(self.footer().encode('utf-8'))
+
+
+def write_schema_zip(schema_file_path):
+    """Writes an ancilliary zip file holding the benchmark schema"""
+    with zipfile.ZipFile(schema_file_path, 'w', zipfile.ZIP_DEFLATED) as schema_zip:
+        schema_zip.write(SCHEMA_FILE_PATH, 'HSCOrgRefData.xsd')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Generate synthetic ODS XML data for benchmarking")
+
+    parser.add_argument("-n", "--organisations", type=int, default=10000,
+                        help="number of organisations to generate")
+    parser.add_argument("--roles", type=int, default=2,
+                        help="number of roles per organisation (at least 1)")
+    parser.add_argument("--relationships", type=int, default=1,
+                        help="number of relationships per organisation")
+    parser.add_argument("--successors", type=int, default=1,
+                        help="number of successors per inactive organisation")
+    parser.add_argument("--addresses", type=int, default=1,
+                        help="number of addresses per organisation")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed, the same seed always generates the same organisations")
+    parser.add_argument("--seqno", type=int, default=1,
+                        help="publication sequence number to put in the manifest")
+    parser.add_argument("-x", "--xml", type=str, default='data/bench_fullfile.zip',
+                        help="path of the XML data zip file to write")
+    parser.add_argument("-s", "--schema", type=str, default='data/bench_ancilliary.zip',
+                        help="path of the XSD schema zip file to write")
+
+    args = parser.parse_args()
+
+    for output_path in (args.xml, args.schema):
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    generator = ODSDataGenerator(args.organisations, args.roles, args.relationships, args.successors,
+                                 args.addresses, seed=args.seed)
+    generator.write_zip(args.xml, args.seqno)
+    write_schema_zip(args.schema)
@@ -0,0 +1,122 @@
+import logging
+
+from sqlalchemy import bindparam
+
+from import_tool.models.base import Base
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+class ODSBulkWriter(object):
+    """Buffers plain row dictionaries for each table and writes them to the database
+    in batches with a single executemany per table, bypassing the ORM unit of work.
+    All batches are written inside one transaction which is committed or rolled back
+    as a whole, unless the import commits what it has written so far with checkpoint()
+
+    """
+
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, metadata=None):
+        self.engine = engine
+        self.batch_size = batch_size
+        # The tables the rows are written to, defaulting to those of the models
+        self.metadata = metadata if metadata is not None else Base.metadata
+
+        self.__buffers = {}
+        self.__deletes = {}
+
+        self.connection = engine.connect()
+        self.transaction = self.connection.begin()
+
+    def add(self, table_name, row):
+        """Queue a row for insert, flushing all of the buffers once this table's batch is full
+
+        Parameters
+        ----------
+        table_name: name of the table the row belongs to
+        row: dictionary of column name to value, every row for a table must have the same keys
+
+        Returns
+        -------
+        None
+        """
+        if self._buffer_row(table_name, row) >= self.batch_size:
+            self.flush()
+
+    def delete(self, table_name, column_name, value):
+        """Queue the deletion of existing rows, which is carried out before the next batch of rows is written
+
+        Parameters
+        ----------
+        table_name: name of the table to delete from
+        column_name: name of the column to match on
+        value: delete the rows where the column has this value
+
+        Returns
+        -------
+        None
+        """
+        self.__deletes.setdefault((table_name, column_name), []).append(value)
+
+    def flush(self):
+        """Carry out any queued deletions, child tables first, then write out every
+        buffered row, parent tables first
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        for table in reversed(self.metadata.sorted_tables):
+            self.__flush_deletes(table)
+
+        for table in self.metadata.sorted_tables:
+            self._flush_table(table)
+
+    def __flush_deletes(self, table):
+        for column in table.columns:
+            values = self.__deletes.pop((table.name, column.name), None)
+
+            if values:
+                log.debug("Deleting %s rows from %s" % (len(values), table.name))
+                self.connection.execute(table.delete().where(column == bindparam('delete_value')),
+                                        [{'delete_value': value} for value in values])
+
+    def _buffer_row(self, table_name, row):
+        """Add a row to the table's buffer and return the number of rows now buffered"""
+        rows = self.__buffers.setdefault(table_name, [])
+        rows.append(row)
+        return len(rows)
+
+    def _flush_table(self, table):
+        rows = self.__buffers.get(table.name)
+
+        if rows:
+            log.debug("Writing %s rows to %s" % (len(rows), table.name))
+            self.connection.execute(table.insert(), rows)
+            self.__buffers[table.name] = []
+
+    def _clear_buffers(self):
+        self.__buffers = {}
+
+    def commit(self):
+        self.flush()
+        self.transaction.commit()
+
+    def checkpoint(self):
+        """Commit everything written so far and carry on in a new transaction"""
+        self.flush()
+        self.transaction.commit()
+        self.transaction = self.connection.begin()
+
+    def rollback(self):
+        self._clear_buffers()
+        self.__deletes = {}
+        self.transaction.rollback()
+
+    def close(self):
+        self.connection.close()
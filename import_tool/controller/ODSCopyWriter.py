@@ -0,0 +1,94 @@
+import datetime
+import io
+import logging
+
+from sqlalchemy import Date
+
+from import_tool.controller.ODSBulkWriter import ODSBulkWriter, DEFAULT_BATCH_SIZE
+
+log = logging.getLogger(__name__)
+
+
+def format_copy_value(value, column):
+    """Render a single value in the PostgreSQL COPY text format
+
+    Parameters
+    ----------
+    value: the python value to render
+    column: the SQLAlchemy column the value is destined for
+
+    Returns
+    -------
+    String: the escaped text representation
+    """
+    if value is None:
+        return '\\N'
+
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    if isinstance(value, datetime.date) and isinstance(column.type, Date):
+        return value.strftime('%Y-%m-%d')
+
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class ODSCopyWriter(ODSBulkWriter):
+    """Streams rows into PostgreSQL with COPY ... FROM STDIN. Each table has its own
+    in-memory text buffer which is sent to the server once it holds a batch of rows.
+    The COPY statements run on the writer's connection so they share its transaction
+
+    """
+
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, metadata=None):
+        if engine.dialect.name != 'postgresql':
+            raise ValueError("The copy loader is only available for PostgreSQL")
+
+        super(ODSCopyWriter, self).__init__(engine, batch_size, metadata)
+
+        self.__preparer = engine.dialect.identifier_preparer
+        self._clear_buffers()
+
+    def _buffer_row(self, table_name, row):
+        """Render a row into the table's text buffer and return the number of rows now buffered"""
+        if table_name not in self.__buffers:
+            table = self.metadata.tables[table_name]
+            # Columns missing from the row (e.g. generated primary keys) are left to their defaults
+            self.__columns[table_name] = [column for column in table.columns if column.name in row]
+            self.__buffers[table_name] = io.StringIO()
+            self.__counts[table_name] = 0
+
+        line = '\t'.join(format_copy_value(row[column.name], column)
+                         for column in self.__columns[table_name])
+        self.__buffers[table_name].write(line + '\n')
+        self.__counts[table_name] += 1
+
+        return self.__counts[table_name]
+
+    def _flush_table(self, table):
+        if not self.__counts.get(table.name):
+            return
+
+        log.debug("Copying %s rows to %s" % (self.__counts[table.name], table.name))
+
+        statement = 'COPY %s (%s) FROM STDIN' % (
+            self.__preparer.format_table(table),
+            ', '.join(self.__preparer.quote(column.name) for column in self.__columns[table.name]))
+
+        buffer = self.__buffers[table.name]
+        buffer.seek(0)
+
+        cursor = self.connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+
+        self.__buffers[table.name] = io.StringIO()
+        self.__counts[table.name] = 0
+
+    def _clear_buffers(self):
+        self.__buffers = {}
+        self.__columns = {}
+        self.__counts = {}
@@ -1,51 +1,122 @@
+import collections
+import copy
 import datetime
+import itertools
 import logging
-import sys
+import multiprocessing
+from lxml import etree as xml_tree_parser
+from sqlalchemy import func, select
 from tqdm import tqdm
 
-from sqlalchemy.orm import sessionmaker
+from import_tool.controller.ODSBulkWriter import ODSBulkWriter, DEFAULT_BATCH_SIZE
+from import_tool.controller.ODSCopyWriter import ODSCopyWriter
+from import_tool.controller.ODSIndexBuilder import build_indexes, create_tables
+from import_tool.controller.ODSMetrics import ODSMetrics
+from import_tool.controller.ODSNormalisedSchema import check_schema_mode, create_views, enum_values, \
+    normalised_metadata, physical_table_name, ODSEnumEncoder
+from import_tool.controller.ODSPipeline import ODSPipeline, DEFAULT_QUEUE_SIZE
+from import_tool.controller.ODSOrganisationHierarchy import active_status, create_organisation_hierarchy
+from import_tool.controller.ODSOrganisationExtractor import allocated_ref_columns, extract_organisation, \
+    extract_serialised_organisations, init_worker, ODSRefAllocator
+from import_tool.controller.ODSRowCache import ODSCacheRecorder, read_cached_rows
+from import_tool.controller.ODSSearchIndex import build_search_index
+from import_tool.controller.ODSSuccessorClosure import create_successor_closure, successor_link_type
+from import_tool.controller.ODSXSLTExtractor import extract_organisation_with_xslt
 # import models
 from import_tool.models.Address import Address
 from import_tool.models.base import Base
 from import_tool.models.CodeSystem import CodeSystem
+from import_tool.models.ImportState import ImportState
 from import_tool.models.Organisation import Organisation
+from import_tool.models.OrganisationHierarchy import OrganisationHierarchy
 from import_tool.models.Relationship import Relationship
 from import_tool.models.Role import Role
 from import_tool.models.Successor import Successor
+from import_tool.models.SuccessorClosure import SuccessorClosure
 from import_tool.models.Version import Version
 from import_tool.models.Setting import Setting
 
-schema_version = '015'
+schema_version = '019'
 
+# The writers available to load the extracted rows into the database
+loaders = {
+    'insert': ODSBulkWriter,
+    'copy': ODSCopyWriter
+}
 
-def convert_string_to_date(string):
-    return datetime.datetime.strptime(string, '%Y-%m-%d')
+# The ways of extracting the rows of an organisation, which all give the same rows
+extractors = {
+    'python': extract_organisation,
+    'xslt': extract_organisation_with_xslt
+}
 
+# Number of organisations sent to a worker process at a time
+worker_chunk_size = 500
 
-class ODSDBCreator(object):
+# Number of organisations passed between the stages of the pipeline at a time
+pipeline_chunk_size = 100
 
-    __ods_xml_data = None
-    __code_system_dict = {}
 
-    def __init__(self, engine):
-        # Create the SQLAlchemy session
-        logger = logging.getLogger(__name__)
-        logger.debug("Creating SQLAlchemy session")
-        Session = sessionmaker(bind=engine)
-        self.session = Session()
+class ODSDBCreator(object):
 
-        # Creates the tables of all objects derived from our Base object
-        metadata = Base.metadata
-        metadata.create_all(engine)
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, loader='insert', workers=1, incremental=False,
+                 defer_indexes=False, metrics=None, pipeline=False, queue_size=DEFAULT_QUEUE_SIZE,
+                 writer_factory=None, normalised=False, search_index=False, organisation_filter=None,
+                 checkpoint=None, resume=False, extractor='python'):
+        self.engine = engine
+        self.batch_size = batch_size
+        # Called with the engine, batch size and tables to create the writer, e.g. to write somewhere
+        # other than the engine
+        self.writer_factory = writer_factory or loaders[loader]
+        # Turns each Organisation element into its rows, in Python or with an XSLT stylesheet
+        self.extract = extractors[extractor]
+        self.workers = workers
+        self.incremental = incremental
+        self.metrics = metrics if metrics is not None else ODSMetrics()
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+        self.search_index = search_index
+        # An ODSOrganisationFilter picking the organisations to import
+        self.organisation_filter = organisation_filter
+        # Commit every checkpoint organisations, recording how far the import has got in import_state,
+        # and with resume carry on from where an earlier import of the same data file got to
+        self.checkpoint = checkpoint
+        self.resume = resume
+
+        # Filled in by each import, so that nothing is carried over from one creator to another
+        self.__ods_xml_data = None
+        self.__code_system_dict = {}
+
+        # The normalised schema stores the low cardinality text columns as references to enum_values,
+        # with views standing in for the tables the API reads
+        self.normalised = normalised
+        self.metadata = normalised_metadata if normalised else Base.metadata
+        check_schema_mode(engine, normalised)
+
+        # Creates the tables of all objects derived from our Base object, optionally
+        # leaving their indexes to be built once the data is loaded
+        self.__deferred_indexes = create_tables(engine, defer_indexes, self.metadata)
+
+        if normalised:
+            create_views(engine)
+
+    def __add_row(self, table_name, row):
+        self.metrics.count_row(table_name)
+        self.__writer.add(table_name, row)
 
     def __create_settings(self):
     
         logger = logging.getLogger(__name__)
         logger.debug("Setting schema version")
-        setting = Setting()
-        setting.key = 'schema_version'
-        setting.value = schema_version
-        self.session.add(setting)
+        setting = {
+            'key': 'schema_version',
+            'value': schema_version
+        }
+
+        if self.incremental:
+            self.__writer.delete(Setting.__tablename__, 'key', setting['key'])
+
+        self.__add_row(Setting.__tablename__, setting)
 
     def __create_codesystems(self):
         """Loops through all the code systems in an organisation and adds them
@@ -71,16 +142,11 @@ class ODSDBCreator(object):
             './CodeSystems/CodeSystem[@name="OrganisationRole"]']
 
         for code_system_type in code_system_types:
-            # we are going to need to append a lot of data into this array
-            codesystems = {}
 
             relationships = self.__ods_xml_data.find(code_system_type)
             relationship_types = {}
 
-            # enumerate the iter as it doesn't provide an index which we need
-            for idx, relationship in enumerate(relationships.findall('concept')):
-
-                codesystems[idx] = CodeSystem()
+            for relationship in relationships.findall('concept'):
 
                 relationship_id = relationship.attrib.get('id')
                 display_name = relationship.attrib.get('displayName')
@@ -90,38 +156,40 @@ class ODSDBCreator(object):
                 code_system_type_name = code_system_type_name.replace(
                     './CodeSystems/CodeSystem[@name="', '').replace('"]', '')
 
-                codesystems[idx].id = relationship_id
-                codesystems[idx].name = code_system_type_name
-                codesystems[idx].displayname = display_name
+                codesystem = {
+                    'id': relationship_id,
+                    'name': code_system_type_name,
+                    'displayname': display_name
+                }
 
                 # pop these in a global  dictionary, we will use these later in __create_organisations
                 self.__code_system_dict[relationship_id] = display_name
 
-                # append this instance of code system to the session
-                self.session.add(codesystems[idx])
+                # queue this code system row for writing, unless it was committed before the import was resumed
+                if self.__resume_after is None:
+                    self.__add_row(CodeSystem.__tablename__, codesystem)
 
         primary_role_scope = './Manifest/PrimaryRoleScope'
 
         primary_role_scopes = self.__ods_xml_data.find(primary_role_scope)
 
-        for idx, primary_role in enumerate(primary_role_scopes.findall('PrimaryRole')):
-
-            codesystems = {}
-
-            codesystems[idx] = CodeSystem()
+        for primary_role in primary_role_scopes.findall('PrimaryRole'):
 
             primary_role_id = primary_role.attrib.get('id')
             primary_role_display_name = primary_role.attrib.get('displayName')
             code_system_type_name = 'PrimaryRoleScope'
 
-            codesystems[idx].id = primary_role_id
-            codesystems[idx].name = code_system_type_name
-            codesystems[idx].displayname = primary_role_display_name
+            codesystem = {
+                'id': primary_role_id,
+                'name': code_system_type_name,
+                'displayname': primary_role_display_name
+            }
 
-            self.session.add(codesystems[idx])
+            if self.__resume_after is None:
+                self.__add_row(CodeSystem.__tablename__, codesystem)
 
     def __create_organisations(self):
-        """Creates the organisations and adds them to the session
+        """Creates the organisations and queues them with the writer
 
         Parameters
         ----------
@@ -136,299 +204,472 @@ class ODSDBCreator(object):
         logger = logging.getLogger(__name__)
         logger.debug("Adding organisation information")
 
-        organisations = {}
+        organisations = self.__organisations
+
+        if self.__resume_after is not None:
+            organisations = self.__skip_to_checkpoint(organisations)
+
+        # Filtered out before the incremental comparison, so that an organisation which no longer
+        # passes the filters counts as removed
+        if self.organisation_filter is not None:
+            organisations = self.organisation_filter.filter(organisations, self.__code_system_dict)
+
+        if self.incremental:
+            organisations = self.__changed_organisations(organisations)
 
         if self.__test_mode:
             test_import_limit = 10
-            test_import_count = 0
+            organisations = itertools.islice(organisations, test_import_limit + 1)
+
+        organisations = tqdm(organisations, unit='org')
+
+        # The workers are started before any pipeline threads, so none of the threads' state is forked
+        if self.workers > 1:
+            logger.debug("Extracting organisations with %s worker processes" % self.workers)
+            pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+                                        initargs=(self.__code_system_dict, self.extract))
+        else:
+            pool = None
+
+        try:
+            if self.pipeline:
+                self.__create_organisations_in_pipeline(organisations, pool)
+                return
+
+            if pool is not None:
+                extracted_organisations = self.__extract_organisations_in_parallel(organisations, pool)
+            else:
+                extracted_organisations = (self.extract(organisation_xml, self.__code_system_dict)
+                                           for organisation_xml in organisations)
+
+            for rows in extracted_organisations:
+                # Keys are assigned here rather than in the workers so they follow document order
+                self.__refs.assign(rows)
+                self.__write_organisation(rows)
+
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def __write_organisation(self, rows):
+        """Queues the rows of one organisation with the writer, replacing the stored
+        organisation if this is an incremental import
+
+        Parameters
+        ----------
+        rows = the extract_organisation() rows of the organisation
 
-        for idx, organisation in tqdm(enumerate(self.__ods_xml_data.findall(
-                '.Organisations/Organisation'))):
+        Returns
+        -------
+        None
+        """
+        if self.incremental:
+            odscode = rows[0][1]['odscode']
 
-            organisations[idx] = Organisation()
+            if odscode in self.__stored_organisations:
+                self.__delete_organisation(odscode)
 
-            organisations[idx].odscode = organisation.find('OrgId').attrib.get('extension')
+        for table_name, row in rows:
+            self.__add_row(table_name, row)
 
-            organisations[idx].name = organisation.find('Name').text
+            if table_name == Successor.__tablename__:
+                self.__add_successor_link(row)
+            elif table_name == Relationship.__tablename__:
+                self.__add_relationship_link(row)
 
-            organisations[idx].status = organisation.find('Status').attrib.get('value')
+        if self.checkpoint:
+            self.__organisation_count += 1
 
-            organisations[idx].record_class = self.__code_system_dict[organisation.attrib.get('orgRecordClass')]
+            if self.__organisation_count % self.checkpoint == 0:
+                self.__save_checkpoint(rows[0][1]['odscode'])
 
-            organisations[idx].last_changed = organisation.find('LastChangeDate').attrib.get('value')
+    def __save_checkpoint(self, odscode):
+        """Commits everything written so far along with the last organisation written, so that
+        the import can be resumed from here"""
+        logger = logging.getLogger(__name__)
+        logger.debug("Checkpoint after %s organisations at %s" % (self.__organisation_count, odscode))
+
+        self.__writer.delete(ImportState.__tablename__, 'data_file_hash', self.__input_hash)
+        self.__writer.add(ImportState.__tablename__, {
+            'data_file_hash': self.__input_hash,
+            'last_odscode': odscode,
+            'organisation_count': self.__organisation_count,
+            'checkpoint_timestamp': datetime.datetime.now().isoformat()
+        })
 
-            organisations[idx].ref_only = bool(organisation.attrib.get('refOnly'))
+        self.__writer.checkpoint()
 
-            for date in organisation.findall('Date'):
-                if date.find('Type').attrib.get('value') == 'Legal':
+    def __skip_to_checkpoint(self, organisations):
+        """Skips the organisations which were committed before the import was resumed
 
-                    try:
-                        organisations[idx].legal_start_date = \
-                            convert_string_to_date(date.find('Start').attrib.get('value'))
-                    except:
-                        pass
+        Parameters
+        ----------
+        organisations = iterable of Organisation elements
 
-                    try:
-                        organisations[idx].legal_end_date = \
-                            convert_string_to_date(date.find('End').attrib.get('value'))
-                    except:
-                        pass
+        Returns
+        -------
+        Generator: the Organisation elements after the last one committed
+        """
+        organisations = iter(organisations)
+        skipped_count = 0
 
-                elif date.find('Type').attrib.get('value') == 'Operational':
-                    try:
-                        organisations[idx].operational_start_date = \
-                            convert_string_to_date(date.find('Start').attrib.get('value'))
-                    except:
-                        pass
+        for organisation_xml in organisations:
+            skipped_count += 1
 
-                    try:
-                        organisations[idx].operational_end_date = \
-                            convert_string_to_date(date.find('End').attrib.get('value'))
-                    except:
-                        pass
+            if organisation_xml.find('OrgId').attrib.get('extension') == self.__resume_after:
+                break
+        else:
+            raise ValueError("Organisation %s, where the import is to be resumed from, is not in the data"
+                             % self.__resume_after)
 
-            self.session.add(organisations[idx])
+        logger = logging.getLogger(__name__)
+        logger.info("Resuming after %s organisations" % skipped_count)
 
-            self.__create_addresses(organisations[idx], organisation)
+        for organisation_xml in organisations:
+            yield organisation_xml
 
-            self.__create_roles(organisations[idx], organisation)
+    def __add_successor_link(self, successor):
+        """Remembers a link from an organisation to its successor for __create_successor_closure()"""
+        if successor['type'] == successor_link_type and successor['target_odscode']:
+            self.__successors[successor['org_odscode']].append(successor['target_odscode'])
 
-            self.__create_relationships(organisations[idx], organisation)
+    def __add_relationship_link(self, relationship):
+        """Remembers an active relationship for __create_organisation_hierarchy()"""
+        if relationship['status'] == active_status and relationship['target_odscode']:
+            self.__relationships[relationship['org_odscode']].append(
+                (relationship['code'], relationship['target_odscode']))
 
-            self.__create_successors(organisations[idx], organisation)
+    def __create_organisations_in_pipeline(self, organisations, pool):
+        """Creates the organisations with the parse, extract and batch stages each on their
+        own thread, so that they carry on whilst this thread is waiting for the database to
+        write the batches
 
-            if self.__test_mode:
-                test_import_count += 1
-                if test_import_count > test_import_limit:
+        Parameters
+        ----------
+        organisations = iterable of Organisation elements
+        pool = optional pool of worker processes to extract the organisations with
+
+        Returns
+        -------
+        None
+        """
+        logger = logging.getLogger(__name__)
+        logger.debug("Creating organisations in a pipeline")
+
+        pipeline = ODSPipeline(organisations, self.queue_size)
+        pipeline.add_stage('parse', self.__parse_stage)
+        pipeline.add_stage('extract', lambda chunks: self.__extract_stage(chunks, pool))
+        pipeline.add_stage('batch', self.__batch_stage)
+
+        batches = pipeline.run('write')
+
+        try:
+            for batch in batches:
+                for rows in batch:
+                    self.__write_organisation(rows)
+        finally:
+            batches.close()
+            self.metrics.record_pipeline(pipeline.stats)
+
+    def __parse_stage(self, organisations):
+        """Reads the organisations in chunks. A streamed organisation is cleared once the
+        next one has been read, so each is copied before it is handed to the next stage"""
+        chunk = []
+
+        for organisation_xml in organisations:
+            chunk.append(copy.deepcopy(organisation_xml) if self.__streamed else organisation_xml)
+
+            if len(chunk) >= pipeline_chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def __extract_stage(self, chunks, pool):
+        """Extracts the rows of each chunk of organisations"""
+        if pool is not None:
+            organisations = (organisation_xml for chunk in chunks for organisation_xml in chunk)
+            extracted_organisations = self.__extract_organisations_in_parallel(organisations, pool)
+
+            while True:
+                chunk = list(itertools.islice(extracted_organisations, pipeline_chunk_size))
+                if not chunk:
                     break
+                yield chunk
+
+        else:
+            for chunk in chunks:
+                yield [self.extract(organisation_xml, self.__code_system_dict) for organisation_xml in chunk]
 
-        organisations = None
+    def __batch_stage(self, chunks):
+        """Assigns the keys of the extracted organisations and gathers them into batches of
+        about batch_size rows for the writer"""
+        batch = []
+        batch_rows = 0
 
-    def __create_roles(self, organisation, organisation_xml):
-        """Creates the roles, this should only be called from
-         __create_organisations()
+        for chunk in chunks:
+            for rows in chunk:
+                self.__refs.assign(rows)
+                batch.append(rows)
+                batch_rows += len(rows)
+
+            if batch_rows >= self.batch_size:
+                yield batch
+                batch = []
+                batch_rows = 0
+
+        if batch:
+            yield batch
+
+    def __start_incremental_import(self):
+        """Compares the data against the previous import so that only the changes need
+        to be written. The small code system, settings and closure tables are simply replaced
 
         Parameters
         ----------
-        organisation = xml element of the full organisation
+        None
 
         Returns
         -------
+        Boolean: False if this publication has already been imported
+        """
+
+        logger = logging.getLogger(__name__)
+
+        versions = Version.__table__
+        organisations = Organisation.__table__
+        settings = Setting.__table__
+        connection = self.__writer.connection
+
+        previous_version = connection.execute(
+            select([versions.c.publication_seqno, versions.c.file_creation_date])
+            .order_by(versions.c.version_ref.desc()).limit(1)).first()
+
+        self.__stored_organisations = {}
+        self.__refs = ODSRefAllocator(self.__next_refs())
+
+        if previous_version is None:
+            # The version is only written once an import has finished
+            if connection.execute(select([func.count()]).select_from(ImportState.__table__)).scalar():
+                raise ValueError("The first import into the database was interrupted, finish it with --resume")
+
+            logger.info("No previous import found, importing all organisations")
+            return True
+
+        previous_schema_version = connection.execute(
+            select([settings.c.value]).where(settings.c.key == 'schema_version')).scalar()
+
+        if previous_schema_version != schema_version:
+            raise ValueError("The database has schema version %s, a full import is needed to create schema version %s"
+                             % (previous_schema_version, schema_version))
+
+        manifest = self.__ods_xml_data.find('./Manifest')
+        publication_seqno = manifest.find('PublicationSeqNum').attrib.get('value')
+        file_creation_date = manifest.find('FileCreationDateTime').attrib.get('value')
+
+        if previous_version.publication_seqno == publication_seqno and \
+                previous_version.file_creation_date == file_creation_date:
+            logger.info("Publication %s has already been imported" % publication_seqno)
+            return False
+
+        logger.info("Updating from publication %s to %s" % (previous_version.publication_seqno, publication_seqno))
+
+        self.__stored_organisations = dict(connection.execute(
+            select([organisations.c.odscode, organisations.c.last_changed])).fetchall())
+
+        # The closure is rebuilt from the stored links along with the new ones
+        self.__load_stored_links()
+
+        # An interrupted checkpointed update is simply finished off by comparing against it again. The
+        # settings are only replaced at the end, so that it still has the schema version to check
+        for table in (CodeSystem.__table__, SuccessorClosure.__table__, OrganisationHierarchy.__table__,
+                      ImportState.__table__):
+            connection.execute(table.delete())
+
+        return True
+
+    def __start_resumed_import(self):
+        """Picks up an interrupted checkpointed import of the same data file from its last checkpoint
+
+        Parameters
+        ----------
         None
+
+        Returns
+        -------
+        String: the OrgId of the last organisation committed, or None if there is no import to resume
         """
-        roles_xml = organisation_xml.find('Roles')
-        roles = {}
-
-        for idx, role in enumerate(roles_xml):
-
-            roles[idx] = Role()
-
-            roles[idx].organisation_ref = organisation.ref
-            roles[idx].org_odscode = organisation.odscode
-            roles[idx].code = role.attrib.get('id')
-            roles[idx].primary_role = bool(role.attrib.get('primaryRole'))
-            roles[idx].status = role.find('Status').attrib.get('value')
-            roles[idx].unique_id = role.attrib.get('uniqueRoleId')
-
-            # Add Operational and Legal start/end dates if present
-            for date in role.findall('Date'):
-                if date.find('Type').attrib.get('value') == 'Legal':
-                    try:
-                        roles[idx].legal_start_date = \
-                            convert_string_to_date(date.find('Start').attrib.get('value'))
-                    except:
-                        pass
-                    try:
-                        roles[idx].legal_end_date = \
-                            convert_string_to_date(date.find('End').attrib.get('value'))
-                    except:
-                        pass
-
-                elif date.find('Type').attrib.get('value') == 'Operational':
-                    try:
-                        roles[idx].operational_start_date = \
-                            convert_string_to_date(date.find('Start').attrib.get('value'))
-                    except:
-                        pass
-                    try:
-                        roles[idx].operational_end_date = \
-                            convert_string_to_date(date.find('End').attrib.get('value'))
-                    except:
-                        pass
-
-            self.session.add(roles[idx])
-
-        roles = None
-
-    def __create_relationships(self, organisation, organisation_xml):
-        """Creates the relationships, this should only be called from
-         __create_organisations()
+        logger = logging.getLogger(__name__)
+
+        import_state = ImportState.__table__
+        connection = self.__writer.connection
+
+        states = connection.execute(select([import_state.c.data_file_hash, import_state.c.last_odscode,
+                                            import_state.c.organisation_count])).fetchall()
+
+        if not states:
+            self.__check_nothing_imported()
+            logger.info("No interrupted import found, importing all organisations")
+            return None
+
+        state = states[0]
+
+        if len(states) > 1 or state.data_file_hash != self.__input_hash:
+            raise ValueError("The interrupted import was of a different data file, it cannot be resumed with this one")
+
+        logger.info("Resuming the import after %s organisations" % state.organisation_count)
+
+        self.__refs = ODSRefAllocator(self.__next_refs())
+        self.__load_stored_links()
+        self.__organisation_count = state.organisation_count
+
+        return state.last_odscode
+
+    def __check_nothing_imported(self):
+        """Checks that a resume without an interrupted import to carry on from has an empty database
+        to import all the organisations into, rather than one an import has already been completed in
 
         Parameters
         ----------
-        organisation = xml element of the full organisation
+        None
 
         Returns
         -------
         None
         """
-        relationships_xml = organisation_xml.find('Rels')
-        relationships = {}
-
-        if relationships_xml is not None:
-
-            for idx, relationship in enumerate(relationships_xml):
-
-                relationships[idx] = Relationship()
-
-                relationships[idx].organisation_ref = organisation.ref
-                relationships[idx].org_odscode = organisation.odscode
-                relationships[idx].code = relationship.attrib.get('id')
-                relationships[idx].target_odscode = relationship.find(
-                    'Target/OrgId').attrib.get('extension')
-                relationships[idx].status = relationship.find(
-                    'Status').attrib.get('value')
-                relationships[idx].unique_id = relationship.attrib.get(
-                    'uniqueRelId')
-
-                for date in relationship.findall('Date'):
-                    if date.find('Type').attrib.get('value') == 'Legal':
-                        try:
-                            relationships[idx].legal_start_date = \
-                                convert_string_to_date(date.find('Start').attrib.get('value'))
-                        except:
-                            pass
-                        try:
-                            relationships[idx].legal_end_date = \
-                                convert_string_to_date(date.find('End').attrib.get('value'))
-                        except:
-                            pass
-
-                    elif date.find('Type').attrib.get('value') == 'Operational':
-                        try:
-                            relationships[idx].operational_start_date = \
-                                convert_string_to_date(date.find('Start').attrib.get('value'))
-                        except:
-                            pass
-                        try:
-                            relationships[idx].operational_end_date = \
-                                convert_string_to_date(date.find('End').attrib.get('value'))
-                        except:
-                            pass
-
-                # self.__code_system_dict[]
-
-                self.session.add(relationships[idx])
-
-        relationships = None
-
-    def __create_addresses(self, organisation, organisation_xml):
-
-        for idx, location in enumerate(organisation_xml.findall(
-                'GeoLoc/Location')):
-
-            address = Address()
-
-            try:
-                address.org_odscode = organisation.odscode
-            except AttributeError:
-                pass
-
-            try:
-                address.address_line1 = location.find('AddrLn1').text
-            except AttributeError:
-                pass
-
-            try:
-                address.address_line2 = location.find('AddrLn2').text
-            except AttributeError:
-                pass
-
-            try:
-                address.address_line3 = location.find('AddrLn3').text
-            except AttributeError:
-                pass
-
-            try:
-                address.town = location.find('Town').text
-            except AttributeError:
-                pass
-
-            try:
-                address.county = location.find('County').text
-            except AttributeError:
-                pass
-
-            try:
-                address.post_code = location.find('PostCode').text
-            except AttributeError:
-                pass
-
-            try:
-                organisation.post_code = location.find('PostCode').text
-            except AttributeError:
-                pass
-
-            try:
-                address.country = location.find('Country').text
-            except AttributeError:
-                pass
-
-            try:
-                address.uprn = location.find('UPRN').text
-            except AttributeError:
-                pass
-
-            self.session.add(address)
-
-    def __create_successors(self, organisation, organisation_xml):
-
-        for idx, succ in enumerate(organisation_xml.findall(
-                'Succs/Succ')):
-
-            successor = Successor()
-
-            try:
-                successor.unique_id = succ.attrib.get('uniqueSuccId')
-            except AttributeError:
-                pass
-
-            try:
-                successor.org_odscode = organisation.odscode
-            except AttributeError:
-                pass
-
-            try:
-                successor.legal_start_date = \
-                    convert_string_to_date(succ.find('Date/Start').attrib.get('value'))
-            except AttributeError:
-                pass
-
-            try:
-                successor.type = \
-                    succ.find('Type').text
-            except AttributeError:
-                pass
-
-            try:
-                successor.target_odscode = \
-                    succ.find('Target/OrgId').attrib.get('extension')
-            except AttributeError:
-                pass
+        versions = Version.__table__
+        connection = self.__writer.connection
+
+        previous_version = connection.execute(
+            select([versions.c.publication_seqno, versions.c.file_creation_date])
+            .order_by(versions.c.version_ref.desc()).limit(1)).first()
+
+        manifest = self.__ods_xml_data.find('./Manifest')
+        publication_seqno = manifest.find('PublicationSeqNum').attrib.get('value')
+        file_creation_date = manifest.find('FileCreationDateTime').attrib.get('value')
+
+        if previous_version is not None and previous_version.publication_seqno == publication_seqno and \
+                previous_version.file_creation_date == file_creation_date:
+            raise ValueError("The import of publication %s has already been completed, there is nothing to resume"
+                             % publication_seqno)
+
+        if previous_version is not None or \
+                connection.execute(select([func.count()]).select_from(Organisation.__table__)).scalar():
+            raise ValueError("There is no interrupted import to resume, and the database already holds a completed "
+                             "import, which --incremental updates")
+
+    def __next_refs(self):
+        """Returns the keys new rows carry on from, which are after the highest keys already stored"""
+        next_refs = {}
+
+        for table_name, ref_column in allocated_ref_columns.items():
+            table = Base.metadata.tables[table_name]
+            next_refs[table_name] = (self.__writer.connection.execute(
+                select([func.max(table.c[ref_column])])).scalar() or 0) + 1
+
+        return next_refs
+
+    def __load_stored_links(self):
+        """Adds the links of the stored organisations to those the closures are built from"""
+        successors = Successor.__table__
+        relationships = Relationship.__table__
+        connection = self.__writer.connection
+
+        for successor in connection.execute(
+                select([successors.c.org_odscode, successors.c.type, successors.c.target_odscode])):
+            self.__add_successor_link(successor)
 
-            try:
-                successor.target_primary_role_code = \
-                    succ.find('Target/PrimaryRoleId').attrib.get('id')
-            except AttributeError:
-                pass
-
-            try:
-                successor.target_unique_role_id = \
-                    succ.find('Target/PrimaryRoleId').attrib.get('uniqueRoleId')
-            except AttributeError:
-                pass
-
-            self.session.add(successor)
+        for relationship in connection.execute(
+                select([relationships.c.org_odscode, relationships.c.code, relationships.c.status,
+                        relationships.c.target_odscode])):
+            self.__add_relationship_link(relationship)
+
+    def __changed_organisations(self, organisations):
+        """Filters out organisations whose LastChangeDate matches the previous import. The stored
+        rows of those that have changed are replaced by __write_organisation()
+
+        Parameters
+        ----------
+        organisations = iterable of Organisation elements
+
+        Returns
+        -------
+        Generator: the new and changed Organisation elements
+        """
+
+        unchanged_count = 0
+        self.__seen_odscodes = set()
+
+        for organisation_xml in organisations:
+            odscode = organisation_xml.find('OrgId').attrib.get('extension')
+            self.__seen_odscodes.add(odscode)
+
+            if odscode in self.__stored_organisations:
+                last_changed = organisation_xml.find('LastChangeDate').attrib.get('value')
+
+                if self.__stored_organisations[odscode] == last_changed:
+                    unchanged_count += 1
+                    continue
+
+            yield organisation_xml
+
+        logger = logging.getLogger(__name__)
+        logger.debug("Skipped %s unchanged organisations" % unchanged_count)
+
+    def __delete_organisation(self, odscode):
+        for child_table in (Address, Role, Relationship, Successor):
+            self.__writer.delete(child_table.__tablename__, 'org_odscode', odscode)
+
+        self.__writer.delete(Organisation.__tablename__, 'odscode', odscode)
+        self.__successors.pop(odscode, None)
+        self.__relationships.pop(odscode, None)
+
+    def __delete_removed_organisations(self):
+        """Deletes the stored organisations which are no longer present in the data"""
+
+        removed_odscodes = set(self.__stored_organisations) - self.__seen_odscodes
+
+        logger = logging.getLogger(__name__)
+        logger.debug("Removing %s organisations" % len(removed_odscodes))
+
+        for odscode in removed_odscodes:
+            self.__delete_organisation(odscode)
+
+    def __extract_organisations_in_parallel(self, organisations, pool):
+        """Farms the extraction of organisations out to a pool of worker processes.
+        Results are yielded in document order so the output matches the serial path
+        exactly, and only a few chunks per worker are in flight at once so a streamed
+        file is never read far ahead of the writer
+
+        Parameters
+        ----------
+        organisations = iterable of Organisation elements
+        pool = the pool of worker processes, started with init_worker()
+
+        Returns
+        -------
+        Generator: the extract_organisation() rows of each organisation
+        """
+
+        organisations = iter(organisations)
+        pending = collections.deque()
+
+        while True:
+            chunk = [xml_tree_parser.tostring(organisation_xml) for organisation_xml
+                     in itertools.islice(organisations, worker_chunk_size)]
+
+            if chunk:
+                pending.append(pool.apply_async(extract_serialised_organisations, (chunk,)))
+
+            # Wait for the oldest chunk once enough are queued, or drain the queue at the end
+            while pending and (not chunk or len(pending) >= self.workers * 2):
+                for rows in pending.popleft().get():
+                    yield rows
+
+            if not chunk:
+                break
 
     def __create_version(self):
         """adds all the version information to the versions table
@@ -443,35 +684,229 @@ class ODSDBCreator(object):
 
         logger = logging.getLogger(__name__)
         logger.debug("Adding version information")
-        version = Version()
-
-        version.file_version = self.__ods_xml_data.find(
-            './Manifest/Version').attrib.get('value')
-        version.publication_date = self.__ods_xml_data.find(
-            './Manifest/PublicationDate').attrib.get('value')
-        version.publication_type = self.__ods_xml_data.find(
-            './Manifest/PublicationType').attrib.get('value')
-        version.publication_seqno = self.__ods_xml_data.find(
-            './Manifest/PublicationSeqNum').attrib.get('value')
-        version.publication_source = self.__ods_xml_data.find(
-            './Manifest/PublicationSource').attrib.get('value')
-        version.file_creation_date = self.__ods_xml_data.find(
-            './Manifest/FileCreationDateTime').attrib.get('value')
-        version.import_timestamp = datetime.datetime.now()
-        version.record_count = self.__ods_xml_data.find(
-            './Manifest/RecordCount').attrib.get('value')
-        version.content_description = self.__ods_xml_data.find(
-            './Manifest/ContentDescription').attrib.get('value')
-
-        self.session.add(version)
-
-    def create_database(self, ods_xml_data, test_mode):
+        manifest = self.__ods_xml_data.find('./Manifest')
+
+        version = {
+            'file_version': manifest.find('Version').attrib.get('value'),
+            'publication_date': manifest.find('PublicationDate').attrib.get('value'),
+            'publication_type': manifest.find('PublicationType').attrib.get('value'),
+            'publication_seqno': manifest.find('PublicationSeqNum').attrib.get('value'),
+            'publication_source': manifest.find('PublicationSource').attrib.get('value'),
+            'file_creation_date': manifest.find('FileCreationDateTime').attrib.get('value'),
+            'import_timestamp': datetime.datetime.now(),
+            'record_count': manifest.find('RecordCount').attrib.get('value'),
+            'content_description': manifest.find('ContentDescription').attrib.get('value')
+        }
+
+        self.__add_row(Version.__tablename__, version)
+
+    def __import_xml(self):
+        """Writes the version, codesystem, organisation and settings rows from the xml data
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Boolean: False if there was nothing to import
+        """
+        self.__refs = ODSRefAllocator()
+        self.__successors = collections.defaultdict(list)
+        self.__relationships = collections.defaultdict(list)
+        self.__organisation_count = 0
+        self.__resume_after = None
+
+        if self.incremental:
+            with self.metrics.stage('compare_previous_import'):
+                if not self.__start_incremental_import():
+                    return False
+
+        elif self.resume:
+            with self.metrics.stage('resume'):
+                self.__resume_after = self.__start_resumed_import()
+
+        with self.metrics.stage('codesystems'):
+            self.__create_codesystems()
+
+        # The child rows are extracted from the same element as their organisation,
+        # so they are counted within this stage rather than timed separately
+        with self.metrics.stage('organisations'):
+            self.__create_organisations()
+
+        with self.metrics.stage('settings'):
+            self.__create_settings()
+
+        # A test import only sees a handful of organisations, so cannot tell what was removed
+        if self.incremental and not self.__test_mode:
+            with self.metrics.stage('removed_organisations'):
+                self.__delete_removed_organisations()
+
+        with self.metrics.stage('successor_closure'):
+            self.__create_successor_closure()
+
+        with self.metrics.stage('organisation_hierarchy'):
+            self.__create_organisation_hierarchy()
+
+        # The version is written last, so an interrupted checkpointed import is not taken for a finished one
+        with self.metrics.stage('version'):
+            self.__create_version()
+
+        if self.checkpoint:
+            self.__writer.delete(ImportState.__tablename__, 'data_file_hash', self.__input_hash)
+
+        return True
+
+    def __create_successor_closure(self):
+        """Adds the organisation each organisation's chain of successors ends at, so the
+        current successor of a closed organisation is a single lookup
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        logger = logging.getLogger(__name__)
+        logger.debug("Adding successor closure")
+
+        for table_name, row in create_successor_closure(self.__successors):
+            self.__add_row(table_name, row)
+
+    def __create_organisation_hierarchy(self):
+        """Adds every organisation above each organisation through its active relationships,
+        so the descendants of an organisation are a single range scan
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        logger = logging.getLogger(__name__)
+        logger.debug("Adding organisation hierarchy")
+
+        for table_name, row in create_organisation_hierarchy(self.__relationships):
+            self.__add_row(table_name, row)
+
+    def __import_cached_rows(self, cache_file):
+        """Writes the rows recorded in a row cache entry
+
+        Parameters
+        ----------
+        cache_file: path of the cache entry
+
+        Returns
+        -------
+        Boolean: True
+        """
+        logger = logging.getLogger(__name__)
+        logger.debug("Adding rows from cache")
+
+        with self.metrics.stage('cached_rows'):
+            for table_name, row in read_cached_rows(cache_file):
+                if table_name == Version.__tablename__:
+                    row['import_timestamp'] = datetime.datetime.now()
+
+                self.__add_row(table_name, row)
+
+        return True
+
+    def __reset_sequences(self):
+        """Moves the Postgres sequences of the tables keyed by ODSRefAllocator past the keys
+        it assigned, so rows inserted by anything else don't collide with them"""
+        self.__writer.flush()
+
+        ref_columns = [(physical_table_name(table_name), ref_column)
+                       for table_name, ref_column in allocated_ref_columns.items()]
+
+        if self.normalised:
+            ref_columns.append((enum_values.name, 'ref'))
+
+        for table_name, ref_column in ref_columns:
+            self.__writer.connection.execute(
+                "SELECT setval(pg_get_serial_sequence('{table}', '{column}'), coalesce(max({column}), 0) + 1, false) "
+                "FROM {table}".format(table=table_name, column=ref_column))
+
+    def __run_import(self, populate, row_cache=None, cache_key=None):
+        """Runs an import in a single transaction, then builds any deferred indexes and the search index
+
+        Parameters
+        ----------
+        populate: function which queues the rows with self.__writer, returning False if there was nothing to import
+        row_cache: optional ODSRowCache to record the rows into
+        cache_key: the key to record the rows under
+
+        Returns
+        -------
+        None
+        """
+        logger = logging.getLogger(__name__)
+
+        self.__writer = self.writer_factory(self.engine, self.batch_size, self.metadata)
+
+        if row_cache is not None:
+            self.__writer = ODSCacheRecorder(self.__writer, row_cache, cache_key, self.batch_size)
+
+        # Outside the cache recorder, so the cache holds the encoded rows and replaying them needs no encoding
+        if self.normalised:
+            self.__writer = ODSEnumEncoder(self.__writer)
+
+        try:
+            imported = populate()
+
+            if imported:
+                logger.debug("Committing import")
+                with self.metrics.stage('commit'):
+                    if self.engine.dialect.name == 'postgresql':
+                        self.__reset_sequences()
+
+                    self.__writer.commit()
+
+            else:
+                self.__writer.rollback()
+
+        except Exception:
+            # If anything fails, let's not commit anything
+            logger.exception("Unexpected error")
+            logger.debug("Rolling back...")
+            self.__writer.rollback()
+            logger.debug("Rollback complete")
+            raise
+
+        finally:
+            self.__writer.close()
+
+        if self.__deferred_indexes:
+            logger.debug("Building deferred indexes")
+            # Each table's indexes are built on their own connection, Postgres can run these concurrently
+            with self.metrics.stage('indexes'):
+                build_indexes(self.engine, self.__deferred_indexes,
+                              parallel=self.engine.dialect.name == 'postgresql')
+
+        # Built in bulk from the loaded tables, rather than maintained row by row as they are written
+        if imported and self.search_index:
+            with self.metrics.stage('search_index'):
+                build_search_index(self.engine)
+
+    def create_database(self, ods_xml_data, test_mode, organisations=None, row_cache=None, cache_key=None,
+                        input_hash=None):
         """creates a sqlite database in the current path with all the data
 
         Parameters
         ----------
         ods_xml_data: xml_tree_parser object required that is valid
         TODO: check validity here
+        test_mode: only import a handful of organisations
+        organisations: optional iterable of Organisation elements, e.g. from
+        ODSFileManager.get_latest_xml_stream(). Defaults to every organisation in ods_xml_data
+        row_cache: optional ODSRowCache to record the extracted rows into
+        cache_key: the key to record the rows under
+        input_hash: hash of the data file, which a checkpointed import records its progress against
         Returns
         -------
         None
@@ -479,27 +914,43 @@ class ODSDBCreator(object):
         logger = logging.getLogger(__name__)
         logger.info('Starting import')
 
+        if self.incremental and row_cache is not None:
+            raise ValueError("An incremental import cannot be recorded in the row cache")
+
+        if self.checkpoint and (row_cache is not None or input_hash is None):
+            raise ValueError("A checkpointed import needs the hash of the data file, and cannot be recorded "
+                             "in the row cache")
+
+        self.__input_hash = input_hash
+
         self.__test_mode = test_mode
         self.__ods_xml_data = ods_xml_data
+
+        # Streamed organisations are only valid until the next one is read
+        self.__streamed = organisations is not None
+
+        if organisations is None and ods_xml_data is not None:
+            organisations = ods_xml_data.findall('.Organisations/Organisation')
+        self.__organisations = organisations
+
         if self.__ods_xml_data is not None:
-            try:
-                self.__create_version()
-                self.__create_codesystems()
-                self.__create_organisations()
-                self.__create_settings()
-
-                logger = logging.getLogger(__name__)
-                logger.debug("Committing session")
-                self.session.commit()
-
-            except Exception as e:
-                # If anything fails, let's not commit anything
-                logger = logging.getLogger(__name__)
-                logger.error("Unexpected error:", sys.exc_info()[0])
-                logger.debug("Rolling back...")
-                self.session.rollback()
-                logger.debug("Rollback complete")
-                raise
-
-            finally:
-                self.session.close()
\ No newline at end of file
+            self.__run_import(self.__import_xml, row_cache, cache_key)
+
+    def create_database_from_cache(self, cache_file):
+        """creates the database from rows previously recorded in the row cache,
+        without needing the xml data at all
+
+        Parameters
+        ----------
+        cache_file: path of the cache entry, from ODSRowCache.get()
+        Returns
+        -------
+        None
+        """
+        logger = logging.getLogger(__name__)
+        logger.info('Starting import from cache')
+
+        if self.incremental or self.checkpoint:
+            raise ValueError("An incremental or checkpointed import cannot be run from the row cache")
+
+        self.__run_import(lambda: self.__import_cached_rows(cache_file))
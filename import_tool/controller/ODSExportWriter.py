@@ -0,0 +1,324 @@
+import collections
+import csv
+import datetime
+import gzip
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import Boolean, Date, Integer
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from import_tool.controller.ODSBulkWriter import DEFAULT_BATCH_SIZE
+from import_tool.models.base import Base
+
+# Parquet is optional, as it needs pyarrow
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+log = logging.getLogger(__name__)
+
+# Number of batches of a table which can be waiting for its thread before the import waits too
+max_pending_batches = 2
+
+# The dialects a DDL file is written for, by the name used in its file name
+ddl_dialects = {
+    'postgresql': postgresql.dialect(),
+    'sqlite': sqlite.dialect(),
+}
+
+export_formats = ['csv', 'parquet']
+
+parquet_available = pyarrow is not None
+
+
+def format_csv_value(value, column):
+    """Render a single value for a CSV file. None is written as an empty unquoted field, which
+    PostgreSQL's CSV format reads as NULL, and dates are written without a time
+
+    Parameters
+    ----------
+    value: the python value to render
+    column: the SQLAlchemy column the value is destined for
+
+    Returns
+    -------
+    The value to hand to the csv writer
+    """
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    if isinstance(value, datetime.date) and isinstance(column.type, Date):
+        return value.strftime('%Y-%m-%d')
+
+    return value
+
+
+def serial_column(table):
+    """Returns the column of a table which PostgreSQL creates as SERIAL, its only primary key column
+    when that is an integer generated by the database, or None
+
+    Parameters
+    ----------
+    table: the SQLAlchemy table
+
+    Returns
+    -------
+    Column: the SERIAL column, or None
+    """
+    primary_key = list(table.primary_key)
+
+    if len(primary_key) == 1 and isinstance(primary_key[0].type, Integer) and \
+            primary_key[0].autoincrement in (True, 'auto') and not primary_key[0].foreign_keys:
+        return primary_key[0]
+
+    return None
+
+
+def write_ddl(export_dir):
+    """Writes a file of the CREATE TABLE and CREATE INDEX statements for each supported dialect.
+    The PostgreSQL file ends by moving each SERIAL column's sequence past the keys in its table,
+    which is to be run again once the exported keys have been loaded
+
+    Parameters
+    ----------
+    export_dir: the directory to write schema.<dialect>.sql into
+
+    Returns
+    -------
+    None
+    """
+    for dialect_name, dialect in ddl_dialects.items():
+        statements = []
+
+        for table in Base.metadata.sorted_tables:
+            statements.append(str(CreateTable(table).compile(dialect=dialect)).strip())
+            statements.extend(str(CreateIndex(index).compile(dialect=dialect)).strip()
+                              for index in sorted(table.indexes, key=lambda index: index.name))
+
+        # SQLite carries on from the highest INTEGER PRIMARY KEY by itself
+        if dialect_name == 'postgresql':
+            for table in Base.metadata.sorted_tables:
+                column = serial_column(table)
+
+                if column is not None:
+                    statements.append(
+                        "SELECT setval(pg_get_serial_sequence('{table}', '{column}'), coalesce(max({column}), 0) + 1, "
+                        "false) FROM {table}".format(table=table.name, column=column.name))
+
+        with open(os.path.join(export_dir, 'schema.%s.sql' % dialect_name), 'w') as f:
+            f.write(';\n\n'.join(statements) + ';\n')
+
+
+class _CSVTableFile(object):
+    """A gzipped CSV file of one table's rows"""
+
+    extension = '.csv.gz'
+
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = gzip.open(path, 'wt', newline='', compresslevel=6)
+        # Only values which need it are quoted, so None is left as a bare empty field. The data
+        # has no empty strings, which would be read back as NULL too
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([column.name for column in columns])
+
+    def write(self, rows):
+        columns = self.columns
+        self.writer.writerows([format_csv_value(row.get(column.name), column) for column in columns]
+                              for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetTableFile(object):
+    """A Parquet file of one table's rows, with a row group per batch"""
+
+    extension = '.parquet'
+
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.schema = pyarrow.schema([(column.name, self.__arrow_type(column)) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    @staticmethod
+    def __arrow_type(column):
+        if isinstance(column.type, Boolean):
+            return pyarrow.bool_()
+        if isinstance(column.type, Integer):
+            return pyarrow.int64()
+        if isinstance(column.type, Date):
+            return pyarrow.date32()
+        return pyarrow.string()
+
+    def write(self, rows):
+        arrays = []
+
+        for column, field in zip(self.columns, self.schema):
+            values = [row.get(column.name) for row in rows]
+
+            if isinstance(column.type, Date):
+                values = [value.date() if isinstance(value, datetime.datetime) else value for value in values]
+            elif isinstance(column.type, Integer):
+                # Some integer columns, like successors' unique_id, are extracted as text
+                values = [None if value is None else int(value) for value in values]
+            elif pyarrow.types.is_string(field.type):
+                values = [None if value is None else str(value) for value in values]
+
+            arrays.append(pyarrow.array(values, type=field.type))
+
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ODSExportWriter(object):
+    """Writes each table's rows to its own compressed CSV or Parquet file instead of a database,
+    along with DDL files to create the tables wherever the files are loaded. Each table's file
+    is written on its own thread, and the files only appear under their final names once the
+    import commits.
+
+    Integer primary keys which the database would otherwise generate are numbered here, so that
+    every file can be loaded as it is
+
+    """
+
+    def __init__(self, export_dir, export_format='csv', batch_size=DEFAULT_BATCH_SIZE):
+        if export_format not in export_formats:
+            raise ValueError("Unknown export format %s" % export_format)
+
+        if export_format == 'parquet' and pyarrow is None:
+            raise ValueError("Exporting to Parquet needs the pyarrow package")
+
+        self.export_dir = export_dir
+        self.file_class = _ParquetTableFile if export_format == 'parquet' else _CSVTableFile
+        self.batch_size = batch_size
+
+        # There is no database behind this writer
+        self.connection = None
+
+        if not os.path.isdir(export_dir):
+            os.makedirs(export_dir)
+
+        self.__buffers = {}
+        self.__files = {}
+        self.__next_keys = {}
+        # The tables whose files have been moved into place, which a rollback leaves alone
+        self.committed_tables = []
+        self.__executors = {}
+        self.__pending = collections.defaultdict(collections.deque)
+
+    def __path(self, table_name):
+        return os.path.join(self.export_dir, table_name + self.file_class.extension)
+
+    def add(self, table_name, row):
+        """Queue a row for writing, handing the table's rows to its writing thread once a batch is full
+
+        Parameters
+        ----------
+        table_name: name of the table the row belongs to
+        row: dictionary of column name to value
+
+        Returns
+        -------
+        None
+        """
+        rows = self.__buffers.setdefault(table_name, [])
+        rows.append(row)
+
+        if len(rows) >= self.batch_size:
+            self.__flush_table(table_name)
+
+    def delete(self, table_name, column_name, value):
+        raise ValueError("Rows cannot be deleted from an export")
+
+    def __flush_table(self, table_name):
+        rows = self.__buffers.pop(table_name, None)
+
+        if not rows:
+            return
+
+        table = Base.metadata.tables[table_name]
+
+        if table_name not in self.__files:
+            self.__files[table_name] = self.file_class(self.__path(table_name) + '.tmp', list(table.columns))
+            self.__executors[table_name] = ThreadPoolExecutor(max_workers=1)
+
+        # Number any integer primary key the rows were not given
+        for column in table.primary_key:
+            if isinstance(column.type, Integer) and column.name not in rows[0]:
+                next_key = self.__next_keys.get(table_name, 1)
+
+                for next_key, row in enumerate(rows, next_key):
+                    row[column.name] = next_key
+
+                self.__next_keys[table_name] = next_key + 1
+
+        log.debug("Writing %s rows to %s" % (len(rows), table_name))
+        # A single thread per table keeps each table's batches in order
+        pending = self.__pending[table_name]
+        pending.append(self.__executors[table_name].submit(self.__files[table_name].write, rows))
+
+        # Don't let batches pile up in memory if the files can't be written as fast as the rows arrive
+        while len(pending) > max_pending_batches:
+            pending.popleft().result()
+
+    def flush(self):
+        for table_name in list(self.__buffers):
+            self.__flush_table(table_name)
+
+        # Wait for everything to be written, raising any error from the threads
+        for pending in self.__pending.values():
+            while pending:
+                pending.popleft().result()
+
+    def commit(self):
+        # Every table gets a file, even if it has no rows
+        for table in Base.metadata.sorted_tables:
+            if table.name not in self.__files and table.name not in self.__buffers:
+                self.__files[table.name] = self.file_class(self.__path(table.name) + '.tmp', list(table.columns))
+
+        self.flush()
+        self.__close_files()
+
+        for table_name in list(self.__files):
+            os.replace(self.__path(table_name) + '.tmp', self.__path(table_name))
+            self.committed_tables.append(table_name)
+            del self.__files[table_name]
+
+        write_ddl(self.export_dir)
+        log.debug("Exported %s tables to %s" % (len(self.committed_tables), self.export_dir))
+
+    def rollback(self):
+        self.__buffers = {}
+        self.__close_files()
+
+        # A commit which failed part way through has already moved some of the files into place
+        for table_name in self.__files:
+            temp_path = self.__path(table_name) + '.tmp'
+
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        if self.committed_tables:
+            log.warning("The files of %s tables had already been written to %s"
+                        % (len(self.committed_tables), self.export_dir))
+
+        self.__files = {}
+
+    def __close_files(self):
+        for executor in self.__executors.values():
+            executor.shutdown()
+        self.__executors = {}
+
+        for table_file in self.__files.values():
+            table_file.close()
+
+    def close(self):
+        pass
@@ -1,20 +1,41 @@
 from lxml import etree as xml_tree_parser
+import copy
+import hashlib
 import logging
 import os.path
 import sys
+import time
 import urllib.request
 import zipfile
 
+from import_tool.controller.ODSMetrics import ODSMetrics
+from import_tool.controller.ODSRowCache import file_hash
+
 log = logging.getLogger('import_ods_xml')
 
+xml_schema_namespace = 'http://www.w3.org/2001/XMLSchema'
+
+# The parts of the document which are validated one at a time when streaming
+streamed_fragments = ('Manifest', 'CodeSystems', 'Organisation')
+
+# Schemas compiled by this process, keyed by the hash of the xsd and whether it is the fragment
+# variant, so that running several imports in one process only compiles each schema once
+compiled_schemas = {}
+
 
 class ODSFileManager(object):
 
     __ods_xml_data = None
     __ods_schema = None
+    __ods_fragment_schema = None
 
-    def __init__(self, xml_file_path, schema_file_path, xml_url=None, schema_url=None):
+    def __init__(self, xml_file_path, schema_file_path, xml_url=None, schema_url=None,
+                 validation_cache=None, revalidate=False, metrics=None):
         try:
+            self.validation_cache = validation_cache
+            self.revalidate = revalidate
+            self.metrics = metrics if metrics is not None else ODSMetrics()
+
             self.xml_file_path = xml_file_path
             log.debug('xml_file_path is %s' % self.xml_file_path)
 
@@ -127,34 +148,167 @@ class ODSFileManager(object):
             if os.path.isfile(file_name):
                 return file_name
 
+    def __read_schema_document(self, schema_filename):
+        """Read the ODS XSD out of the schema zip file
+
+        Parameters
+        ----------
+        String: filename of the zip file containing the xsd
+
+        Returns
+        -------
+        Bytes: the content of the xsd
+        """
+        with zipfile.ZipFile(schema_filename) as local_zipfile:
+            log.debug("Schema zip contains %s" % local_zipfile.namelist())
+
+            # extract the schema file from the zip
+            with local_zipfile.open('HSCOrgRefData.xsd') as f:
+                return f.read()
+
     def __retrieve_latest_schema(self, schema_filename):
         """Get the latest XSD for the ODS XML data and return it as an
         XMLSchema object
 
         Parameters
         ----------
-        None
+        String: filename of the zip file containing the xsd
 
         Returns
         -------
         xml_schema: the ODS XSD as an XMLSchema object
         """
         try:
-            print(schema_filename)
-            with zipfile.ZipFile(schema_filename) as local_zipfile:
-                # get to the name of the actual zip file
-                zip_info = local_zipfile.namelist()
-                print(zip_info)
+            schema_document = self.__read_schema_document(schema_filename)
+            schema_key = (hashlib.sha256(schema_document).hexdigest(), 'document')
+
+            if schema_key not in compiled_schemas:
+                doc = xml_tree_parser.fromstring(schema_document).getroottree()
+                compiled_schemas[schema_key] = xml_tree_parser.XMLSchema(doc)
 
-                # extract the schema file from the zip
-                with local_zipfile.open('HSCOrgRefData.xsd') as f:
-                    doc = xml_tree_parser.parse(f)
-                    return xml_tree_parser.XMLSchema(doc)
+            return compiled_schemas[schema_key]
 
         except:
             print('Unexpected error:', sys.exc_info()[0])
             raise
 
+    def __retrieve_latest_fragment_schema(self, schema_filename):
+        """Get the latest XSD for the ODS XML data, with the Manifest, CodeSystems and
+        Organisation declarations promoted to global elements so that each of these
+        parts of the document can be validated on its own
+
+        Parameters
+        ----------
+        String: filename of the zip file containing the xsd
+
+        Returns
+        -------
+        Tuple: the adapted ODS XSD as an XMLSchema object, and its target namespace
+        """
+        schema_document = self.__read_schema_document(schema_filename)
+        schema_key = (hashlib.sha256(schema_document).hexdigest(), 'fragments')
+
+        if schema_key in compiled_schemas:
+            return compiled_schemas[schema_key]
+
+        doc = xml_tree_parser.fromstring(schema_document).getroottree()
+
+        schema_root = doc.getroot()
+        global_elements = set(element.get('name') for element in schema_root.findall(
+            '{%s}element' % xml_schema_namespace))
+
+        for fragment in streamed_fragments:
+            if fragment in global_elements:
+                continue
+
+            declaration = schema_root.find('.//{%s}element[@name="%s"]' % (xml_schema_namespace, fragment))
+            global_declaration = copy.deepcopy(declaration)
+
+            # These attributes are only allowed on local declarations
+            for attribute in ('minOccurs', 'maxOccurs', 'form'):
+                global_declaration.attrib.pop(attribute, None)
+
+            schema_root.append(global_declaration)
+
+        compiled_schemas[schema_key] = (xml_tree_parser.XMLSchema(doc), schema_root.get('targetNamespace'))
+
+        return compiled_schemas[schema_key]
+
+    def __needs_validation(self, data_filename, schema_filename):
+        """Check whether this data file has already been found to be valid against this schema
+
+        Parameters
+        ----------
+        String: filename of the zip file containing the xml
+        String: filename of the zip file containing the xsd
+
+        Returns
+        -------
+        Boolean: True if the data still needs to be validated
+        """
+        self.__verdict_key = None
+
+        if self.validation_cache is None:
+            return True
+
+        schema_document = self.__read_schema_document(schema_filename)
+        schema_version = xml_tree_parser.fromstring(schema_document).get('version')
+
+        self.__verdict_key = self.validation_cache.key(
+            file_hash(data_filename), hashlib.sha256(schema_document).hexdigest(), schema_version)
+
+        if self.revalidate:
+            log.debug("Revalidating data")
+            return True
+
+        if self.validation_cache.is_valid(self.__verdict_key):
+            log.info("Data has already been validated against this schema, skipping validation")
+            return False
+
+        return True
+
+    def __record_valid(self):
+        if self.__verdict_key is not None:
+            self.validation_cache.record_valid(self.__verdict_key)
+
+    def __validate_fragment(self, element):
+        """Validate a Manifest, CodeSystems or Organisation element against the fragment schema.
+        These are unqualified local elements in the data, so the element is briefly given the
+        schema's namespace to match the promoted global declaration
+
+        Parameters
+        ----------
+        element: the element to validate
+
+        Returns
+        -------
+        Boolean: True if the element is valid, or if validation is not needed
+        """
+        if self.__ods_fragment_schema is None:
+            return True
+
+        schema, target_namespace = self.__ods_fragment_schema
+        tag = element.tag
+
+        if target_namespace:
+            element.tag = '{%s}%s' % (target_namespace, tag)
+
+        # Each organisation is validated as it streams past, so the time is added up here
+        # rather than measured as a stage of its own
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        try:
+            valid = schema.validate(element)
+        finally:
+            element.tag = tag
+            self.metrics.add_time('validate', time.perf_counter() - wall_start, time.process_time() - cpu_start)
+
+        if not valid:
+            log.error(schema.error_log)
+
+        return valid
+
     def __import_latest_datafile(self, data_filename):
         """Determine if we have a zip file or xml file, check that it is valid,
         and then populate an etree object that we can parse
@@ -183,6 +337,66 @@ class ODSFileManager(object):
             print('Unexpected error:', sys.exc_info()[0])
             raise
 
+    def __stream_latest_datafile(self, data_filename):
+        """Incrementally parse the data file with iterparse rather than loading the whole tree.
+        The first item yielded is the root element holding the Manifest and CodeSystems headers,
+        after that each Organisation element is yielded in document order. Organisations that have
+        already been processed are cleared from the tree so memory use stays flat
+
+        Parameters
+        ----------
+        String: filename of the zip file containing the xml
+
+        Returns
+        -------
+        Generator: the header root element, followed by each Organisation element
+        """
+
+        with zipfile.ZipFile(data_filename) as local_zipfile:
+            # get to the name of the actual zip file
+            zip_info = local_zipfile.namelist()
+
+            # extract the first file in the zip, assumption there will be
+            # only one
+            with local_zipfile.open(zip_info[0]) as local_datafile:
+                log.debug("Streaming data")
+                context = xml_tree_parser.iterparse(
+                    local_datafile, events=('end',), tag=('Manifest', 'CodeSystems', 'Organisation'))
+
+                root = None
+
+                for event, element in context:
+                    if root is None:
+                        root = element.getparent()
+
+                    if element.tag == 'CodeSystems':
+                        for header in (root.find('Manifest'), element):
+                            if not self.__validate_fragment(header):
+                                raise Exception("%s is not valid against the schema" % header.tag)
+
+                        # The headers always precede the organisations, so the root is now
+                        # complete enough for the version and codesystem lookups
+                        yield root
+
+                    elif element.tag == 'Organisation' and element.getparent().tag == 'Organisations':
+                        # Validate each organisation just before it is extracted, so validation
+                        # is spread through the import rather than being a separate pass
+                        if not self.__validate_fragment(element):
+                            raise Exception("Organisation %s is not valid against the schema" %
+                                            element.find('OrgId').attrib.get('extension'))
+
+                        yield element
+
+                        # Free the organisation we have just handed out along with any
+                        # siblings which are still hanging off the parent
+                        element.clear()
+                        while element.getprevious() is not None:
+                            del element.getparent()[0]
+
+        # Only a stream which has been read to the end has had every organisation validated
+        if self.__ods_fragment_schema is not None:
+            self.__record_valid()
+
     def __validate_xml_against_schema(self):
         try:
 
@@ -216,14 +430,54 @@ class ODSFileManager(object):
         xml_tree_parser: containing the entire xml dataset
         """
 
-        if self.__ods_schema is None:
-            schema_filename = self.__retrieve_latest_schema_file()
-            self.__ods_schema = self.__retrieve_latest_schema(schema_filename)
-
         if self.__ods_xml_data is None:
+            schema_filename = self.__retrieve_latest_schema_file()
             data_filename = self.__retrieve_latest_datafile()
-            self.__import_latest_datafile(data_filename)
-            self.__validate_xml_against_schema()
+
+            needs_validation = self.__needs_validation(data_filename, schema_filename)
+
+            if needs_validation and self.__ods_schema is None:
+                with self.metrics.stage('schema'):
+                    self.__ods_schema = self.__retrieve_latest_schema(schema_filename)
+
+            with self.metrics.stage('parse'):
+                self.__import_latest_datafile(data_filename)
+
+            if needs_validation:
+                with self.metrics.stage('validate'):
+                    self.__validate_xml_against_schema()
+                self.__record_valid()
 
         log.info("Data loaded")
         return self.__ods_xml_data
+
+    def get_latest_xml_stream(self):
+        """Stream the latest ODS xml data one organisation at a time instead of loading the
+        entire dataset into memory
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Tuple: the root element holding the Manifest and CodeSystems, and a generator
+        yielding each Organisation element once it has been validated against the schema
+        """
+
+        schema_filename = self.__retrieve_latest_schema_file()
+        data_filename = self.__retrieve_latest_datafile()
+
+        if self.__needs_validation(data_filename, schema_filename):
+            with self.metrics.stage('schema'):
+                self.__ods_fragment_schema = self.__retrieve_latest_fragment_schema(schema_filename)
+        else:
+            self.__ods_fragment_schema = None
+
+        # Only the headers are parsed here, the organisations are parsed as the import reads them
+        with self.metrics.stage('parse'):
+            organisations = self.__stream_latest_datafile(data_filename)
+            header = next(organisations)
+
+        log.info("Data headers loaded")
+        return header, organisations
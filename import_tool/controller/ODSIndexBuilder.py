@@ -0,0 +1,89 @@
+import collections
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateTable
+
+from import_tool.models.base import Base
+
+log = logging.getLogger(__name__)
+
+
+def create_tables(engine, defer_indexes=False, metadata=None):
+    """Creates any of the model tables which do not exist yet
+
+    Parameters
+    ----------
+    engine: the SQLAlchemy engine to create the tables with
+    defer_indexes: create the tables without their secondary indexes, so that the data can be
+    loaded without maintaining them row by row
+    metadata: the tables to create, defaulting to those of the models
+
+    Returns
+    -------
+    List: the indexes which still need to be built with build_indexes()
+    """
+    if metadata is None:
+        metadata = Base.metadata
+
+    if not defer_indexes:
+        metadata.create_all(engine)
+        return []
+
+    deferred_indexes = []
+
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        existing_tables = inspector.get_table_names()
+
+        for table in metadata.sorted_tables:
+            if table.name in existing_tables:
+                # Pick up any indexes a previous, failed, deferred import did not get round to building
+                existing_indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+                deferred_indexes.extend(index for index in table.indexes if index.name not in existing_indexes)
+            else:
+                log.debug("Creating table %s without indexes" % table.name)
+                connection.execute(CreateTable(table))
+                deferred_indexes.extend(table.indexes)
+
+    return deferred_indexes
+
+
+def build_indexes(engine, indexes, parallel=False):
+    """Builds indexes on tables which have already been loaded
+
+    Parameters
+    ----------
+    engine: the SQLAlchemy engine to build the indexes with
+    indexes: the indexes to build
+    parallel: build the indexes of each table at the same time on separate connections
+
+    Returns
+    -------
+    None
+    """
+    indexes_by_table = collections.OrderedDict()
+    for index in indexes:
+        indexes_by_table.setdefault(index.table.name, []).append(index)
+
+    if not indexes_by_table:
+        return
+
+    log.debug("Building %s indexes on %s tables" % (len(indexes), len(indexes_by_table)))
+
+    if parallel:
+        with ThreadPoolExecutor(max_workers=len(indexes_by_table)) as executor:
+            # list() so that any exception raised in a thread is re-raised here
+            list(executor.map(lambda table_indexes: _build_table_indexes(engine, table_indexes),
+                              indexes_by_table.values()))
+    else:
+        for table_indexes in indexes_by_table.values():
+            _build_table_indexes(engine, table_indexes)
+
+
+def _build_table_indexes(engine, table_indexes):
+    with engine.begin() as connection:
+        for index in table_indexes:
+            log.debug("Building index %s" % index.name)
+            index.create(connection)
@@ -0,0 +1,243 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+# Prefix of every metric written to the Prometheus textfile
+metric_prefix = 'openods_import'
+
+
+def cpu_time():
+    """Returns the CPU time used by this process and by any child processes it has waited for,
+    such as extraction workers"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process or any of its children so far, in MB"""
+    # ru_maxrss is reported in kilobytes on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024.0
+
+
+class ODSMetrics(object):
+    """Records the wall time, CPU time, rows written and peak memory of each stage of an import,
+    and writes them out as a JSON report or a Prometheus textfile
+
+    """
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.pipeline = collections.OrderedDict()
+        self.started = time.time()
+
+        self.__stage_stack = []
+
+    def __get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'wall_time': 0.0, 'cpu_time': 0.0, 'rows': {}, 'rows_per_second': 0.0,
+                                 'peak_rss_mb': 0.0}
+
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measures the block of code it wraps as the named stage. Stages can be nested, and
+        a stage entered more than once accumulates its times and rows
+
+        Parameters
+        ----------
+        name: the name of the stage
+
+        Returns
+        -------
+        Context manager
+        """
+        stage = self.__get_stage(name)
+
+        self.__stage_stack.append(stage)
+        wall_start = time.time()
+        cpu_start = cpu_time()
+
+        try:
+            yield
+        finally:
+            self.__stage_stack.pop()
+
+            stage['wall_time'] += time.time() - wall_start
+            stage['cpu_time'] += cpu_time() - cpu_start
+            stage['peak_rss_mb'] = peak_rss_mb()
+
+            total_rows = sum(stage['rows'].values())
+            stage['rows_per_second'] = total_rows / stage['wall_time'] if stage['wall_time'] else 0.0
+
+            log.debug("Stage %s took %.2fs (%.2fs CPU), %s rows" % (name, stage['wall_time'], stage['cpu_time'],
+                                                                    total_rows))
+
+    def add_time(self, name, wall_time, cpu_time):
+        """Adds time measured elsewhere to a stage, for work which is done in pieces too small
+        to wrap each of them in stage()
+
+        Parameters
+        ----------
+        name: the name of the stage
+        wall_time: seconds of wall time to add
+        cpu_time: seconds of CPU time to add
+
+        Returns
+        -------
+        None
+        """
+        stage = self.__get_stage(name)
+        stage['wall_time'] += wall_time
+        stage['cpu_time'] += cpu_time
+
+    def record_pipeline(self, pipeline_stats):
+        """Keeps the queue depths and waiting times of the stages of an ODSPipeline
+
+        Parameters
+        ----------
+        pipeline_stats: the stats of the pipeline, by stage name
+
+        Returns
+        -------
+        None
+        """
+        self.pipeline.update(pipeline_stats)
+
+    def count_row(self, table_name):
+        """Counts a row written to a table against the stage currently running
+
+        Parameters
+        ----------
+        table_name: the table the row is written to
+
+        Returns
+        -------
+        None
+        """
+        if self.__stage_stack:
+            rows = self.__stage_stack[-1]['rows']
+            rows[table_name] = rows.get(table_name, 0) + 1
+
+    def report(self):
+        """Returns every stage's measurements along with the totals for the whole import"""
+        wall_time = time.time() - self.started
+
+        rows = {}
+        for stage in self.stages.values():
+            for table_name, count in stage['rows'].items():
+                rows[table_name] = rows.get(table_name, 0) + count
+
+        return {
+            'started': self.started,
+            'finished': time.time(),
+            'wall_time': wall_time,
+            'cpu_time': cpu_time(),
+            'peak_rss_mb': peak_rss_mb(),
+            'rows': rows,
+            'rows_per_second': sum(rows.values()) / wall_time if wall_time else 0.0,
+            'stages': self.stages,
+            'pipeline': self.pipeline,
+        }
+
+    def write_json(self, file_name):
+        """Writes the report as JSON
+
+        Parameters
+        ----------
+        file_name: the file to write
+
+        Returns
+        -------
+        None
+        """
+        _write_atomically(file_name, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, file_name):
+        """Writes the report in the Prometheus text format, for the node exporter's textfile collector.
+        The file is replaced in one go so the collector never reads a half written file
+
+        Parameters
+        ----------
+        file_name: the file to write, which should end in .prom
+
+        Returns
+        -------
+        None
+        """
+        report = self.report()
+        lines = []
+
+        def add_metric(name, help_text, samples):
+            lines.append('# HELP %s_%s %s' % (metric_prefix, name, help_text))
+            lines.append('# TYPE %s_%s gauge' % (metric_prefix, name))
+
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % label for label in labels)
+                lines.append('%s_%s%s %s' % (metric_prefix, name, '{%s}' % label_text if label_text else '',
+                                             repr(float(value))))
+
+        add_metric('last_success_timestamp_seconds', 'Time the last import finished',
+                   [((), report['finished'])])
+        add_metric('wall_seconds', 'Wall time of the whole import', [((), report['wall_time'])])
+        add_metric('cpu_seconds', 'CPU time of the whole import', [((), report['cpu_time'])])
+        add_metric('peak_rss_megabytes', 'Peak resident set size of the import', [((), report['peak_rss_mb'])])
+        add_metric('rows', 'Rows written to each table',
+                   [((('table', table_name),), count) for table_name, count in sorted(report['rows'].items())])
+
+        stage_metrics = [
+            ('stage_wall_seconds', 'Wall time of each stage of the import', 'wall_time'),
+            ('stage_cpu_seconds', 'CPU time of each stage of the import', 'cpu_time'),
+            ('stage_rows_per_second', 'Rows written per second by each stage of the import', 'rows_per_second'),
+            ('stage_peak_rss_megabytes', 'Peak resident set size at the end of each stage of the import',
+             'peak_rss_mb'),
+        ]
+
+        for name, help_text, key in stage_metrics:
+            add_metric(name, help_text, [((('stage', stage_name),), stage[key])
+                                         for stage_name, stage in report['stages'].items()])
+
+        add_metric('stage_rows', 'Rows written to each table by each stage of the import',
+                   [((('stage', stage_name), ('table', table_name)), count)
+                    for stage_name, stage in report['stages'].items()
+                    for table_name, count in sorted(stage['rows'].items())])
+
+        pipeline_metrics = [
+            ('pipeline_items', 'Items each pipeline stage has handed on', 'items'),
+            ('pipeline_input_wait_seconds', 'Time each pipeline stage spent waiting for the stage before it',
+             'input_wait_seconds'),
+            ('pipeline_output_wait_seconds', 'Time each pipeline stage spent waiting for the stage after it',
+             'output_wait_seconds'),
+            ('pipeline_max_queue_depth', 'Most items queued after each pipeline stage', 'max_queue_depth'),
+            ('pipeline_mean_queue_depth', 'Mean items queued after each pipeline stage', 'mean_queue_depth'),
+        ]
+
+        if report['pipeline']:
+            for name, help_text, key in pipeline_metrics:
+                add_metric(name, help_text, [((('stage', stage_name),), stage[key])
+                                             for stage_name, stage in report['pipeline'].items()])
+
+        _write_atomically(file_name, '\n'.join(lines) + '\n')
+
+
+def _write_atomically(file_name, content):
+    directory = os.path.dirname(os.path.abspath(file_name))
+    file_descriptor, temp_file = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+    try:
+        with os.fdopen(file_descriptor, 'w') as f:
+            f.write(content)
+        # mkstemp creates the file readable by its owner alone, the collector may run as another user
+        os.chmod(temp_file, 0o644)
+        os.replace(temp_file, file_name)
+    except:
+        os.remove(temp_file)
+        raise
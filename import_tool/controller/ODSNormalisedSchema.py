@@ -0,0 +1,221 @@
+import collections
+import logging
+
+from sqlalchemy import Column, ForeignKey, Index, Integer, MetaData, String, Table, UniqueConstraint, inspect, \
+    select
+
+# import models, so that Base.metadata has every table to copy
+from import_tool.models.Address import Address
+from import_tool.models.base import Base
+from import_tool.models.CodeSystem import CodeSystem
+from import_tool.models.ImportState import ImportState
+from import_tool.models.Organisation import Organisation
+from import_tool.models.OrganisationHierarchy import OrganisationHierarchy
+from import_tool.models.Relationship import Relationship
+from import_tool.models.Role import Role
+from import_tool.models.Successor import Successor
+from import_tool.models.SuccessorClosure import SuccessorClosure
+from import_tool.models.Version import Version
+from import_tool.models.Setting import Setting
+
+log = logging.getLogger(__name__)
+
+# The low cardinality text columns which the normalised schema stores as references to enum_values,
+# by table, along with the vocabulary each column's values belong to
+encoded_columns = collections.OrderedDict([
+    ('organisations', collections.OrderedDict([('status', 'status'), ('record_class', 'record_class')])),
+    ('roles', collections.OrderedDict([('code', 'role_code'), ('status', 'status')])),
+    ('relationships', collections.OrderedDict([('code', 'relationship_code'), ('status', 'status')])),
+    ('successors', collections.OrderedDict([('type', 'successor_type')])),
+])
+
+normalised_metadata = MetaData()
+
+enum_values = Table('enum_values', normalised_metadata,
+                    Column('ref', Integer, primary_key=True),
+                    Column('name', String(50), nullable=False),
+                    Column('value', String(200), nullable=False),
+                    UniqueConstraint('name', 'value'))
+
+
+def physical_table_name(table_name):
+    """Returns the name a table's rows are stored under in the normalised schema. Tables with
+    encoded columns are stored as <table>_data, leaving their own name to the compatibility view"""
+    return table_name + '_data' if table_name in encoded_columns else table_name
+
+
+def encoded_column_name(column_name):
+    return column_name + '_ref'
+
+
+def _copy_table(table):
+    """Adds the normalised version of one of the model tables to normalised_metadata"""
+    columns = []
+
+    for column in table.columns:
+        if column.name in encoded_columns.get(table.name, {}):
+            columns.append(Column(encoded_column_name(column.name), Integer, ForeignKey(enum_values.c.ref),
+                                  index=column.index))
+        else:
+            foreign_keys = [ForeignKey('%s.%s' % (physical_table_name(foreign_key.column.table.name),
+                                                  foreign_key.column.name))
+                            for foreign_key in column.foreign_keys]
+            columns.append(Column(column.name, column.type, *foreign_keys, primary_key=column.primary_key,
+                                  index=column.index))
+
+    normalised_table = Table(physical_table_name(table.name), normalised_metadata, *columns)
+
+    # The single column indexes come with the columns
+    for index in table.indexes:
+        if len(index.columns) > 1:
+            Index(index.name, *[normalised_table.c[column.name] for column in index.columns])
+
+
+def compatibility_view(table_name):
+    """Returns the query giving a normalised table the columns of the model table, in the same order
+
+    Parameters
+    ----------
+    table_name: name of the model table
+
+    Returns
+    -------
+    Select
+    """
+    table = Base.metadata.tables[table_name]
+    data = normalised_metadata.tables[physical_table_name(table_name)]
+    joined = data
+    columns = []
+
+    for column in table.columns:
+        if column.name in encoded_columns[table_name]:
+            values = enum_values.alias('%s_values' % column.name)
+            joined = joined.outerjoin(values, values.c.ref == data.c[encoded_column_name(column.name)])
+            columns.append(values.c.value.label(column.name))
+        else:
+            columns.append(data.c[column.name])
+
+    return select(columns).select_from(joined)
+
+
+def check_schema_mode(engine, normalised):
+    """Stops an import from mixing the normalised and standard schemas in one database
+
+    Parameters
+    ----------
+    engine: the SQLAlchemy engine of the database
+    normalised: whether the import uses the normalised schema
+
+    Returns
+    -------
+    None
+    """
+    # Views are not included, so the compatibility views don't count as standard tables
+    table_names = set(inspect(engine).get_table_names())
+
+    if normalised and table_names.intersection(encoded_columns):
+        raise ValueError("The database has the standard schema, it cannot be imported into with the normalised schema")
+
+    if not normalised and table_names.intersection(physical_table_name(name) for name in encoded_columns):
+        raise ValueError("The database has the normalised schema, it cannot be imported into with the standard schema")
+
+
+def create_views(engine):
+    """Creates the compatibility views which do not exist yet
+
+    Parameters
+    ----------
+    engine: the SQLAlchemy engine to create the views with
+
+    Returns
+    -------
+    None
+    """
+    view_names = set(inspect(engine).get_view_names())
+
+    with engine.begin() as connection:
+        for table_name in encoded_columns:
+            if table_name not in view_names:
+                log.debug("Creating view %s" % table_name)
+                query = compatibility_view(table_name).compile(dialect=engine.dialect)
+                connection.execute('CREATE VIEW %s AS %s' % (table_name, query))
+
+
+class ODSEnumEncoder(object):
+    """Wraps a writer, replacing the encoded columns of the rows passed through it with references
+    to enum_values and writing them to the normalised tables. Values are numbered here as they are
+    first seen, carrying on from those already stored, and each new value is queued with the writer
+    ahead of the row which uses it
+
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.connection = writer.connection
+
+        self.__refs = {}
+        self.__next_ref = 1
+
+        if self.connection is not None:
+            for ref, name, value in self.connection.execute(select([enum_values.c.ref, enum_values.c.name,
+                                                                    enum_values.c.value])):
+                self.__refs[(name, value)] = ref
+                self.__next_ref = max(self.__next_ref, ref + 1)
+
+    def __encode(self, vocabulary, value):
+        if value is None:
+            return None
+
+        ref = self.__refs.get((vocabulary, value))
+
+        if ref is None:
+            ref = self.__refs[(vocabulary, value)] = self.__next_ref
+            self.__next_ref += 1
+            self.writer.add(enum_values.name, {'ref': ref, 'name': vocabulary, 'value': value})
+
+        return ref
+
+    def add(self, table_name, row):
+        """Encode a row and queue it with the writer
+
+        Parameters
+        ----------
+        table_name: name of the model table the row belongs to
+        row: dictionary of column name to value
+
+        Returns
+        -------
+        None
+        """
+        columns = encoded_columns.get(table_name)
+
+        if columns:
+            row = dict(row)
+            for column_name, vocabulary in columns.items():
+                row[encoded_column_name(column_name)] = self.__encode(vocabulary, row.pop(column_name, None))
+
+            table_name = physical_table_name(table_name)
+
+        self.writer.add(table_name, row)
+
+    def delete(self, table_name, column_name, value):
+        self.writer.delete(physical_table_name(table_name), column_name, value)
+
+    def flush(self):
+        self.writer.flush()
+
+    def checkpoint(self):
+        self.writer.checkpoint()
+
+    def commit(self):
+        self.writer.commit()
+
+    def rollback(self):
+        self.writer.rollback()
+
+    def close(self):
+        self.writer.close()
+
+
+for model_table in Base.metadata.sorted_tables:
+    _copy_table(model_table)
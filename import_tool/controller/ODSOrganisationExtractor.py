@@ -0,0 +1,382 @@
+import datetime
+
+from lxml import etree as xml_tree_parser
+
+from import_tool.models.Address import Address
+from import_tool.models.Organisation import Organisation
+from import_tool.models.Relationship import Relationship
+from import_tool.models.Role import Role
+from import_tool.models.Successor import Successor
+
+# The code system lookup and extraction function used by worker processes, set by init_worker()
+_worker_code_system_dict = None
+_worker_extract = None
+
+# The tables whose primary keys are assigned by ODSRefAllocator, and the name of each one's key
+allocated_ref_columns = dict((model.__tablename__, list(model.__table__.primary_key)[0].name)
+                             for model in (Organisation, Address, Role, Relationship, Successor))
+
+
+def convert_string_to_date(string):
+    return datetime.datetime.strptime(string, '%Y-%m-%d')
+
+
+def extract_organisation(organisation_xml, code_system_dict):
+    """Turns a single Organisation element into plain rows for the organisations table
+    and all of its child tables
+
+    Parameters
+    ----------
+    organisation_xml = xml element of the full organisation
+    code_system_dict = dictionary of code system id to display name
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples in the order they should be written
+    """
+    organisation = {
+        'odscode': organisation_xml.find('OrgId').attrib.get('extension'),
+        'name': organisation_xml.find('Name').text,
+        'status': organisation_xml.find('Status').attrib.get('value'),
+        'record_class': code_system_dict[organisation_xml.attrib.get('orgRecordClass')],
+        'last_changed': organisation_xml.find('LastChangeDate').attrib.get('value'),
+        'legal_start_date': None,
+        'legal_end_date': None,
+        'operational_start_date': None,
+        'operational_end_date': None,
+        'ref_only': bool(organisation_xml.attrib.get('refOnly')),
+        'post_code': None
+    }
+
+    add_dates(organisation, organisation_xml)
+
+    # Addresses are created first as they also set the organisation's post_code
+    addresses = create_addresses(organisation, organisation_xml)
+
+    rows = [(Organisation.__tablename__, organisation)]
+    rows.extend(addresses)
+    rows.extend(create_roles(organisation, organisation_xml))
+    rows.extend(create_relationships(organisation, organisation_xml))
+    rows.extend(create_successors(organisation, organisation_xml))
+
+    return rows
+
+
+def add_dates(row, element):
+    """Sets the Legal and Operational start/end dates on a row from the Date
+    children of an organisation, role or relationship element
+
+    Parameters
+    ----------
+    row = dictionary of column values to update
+    element = xml element with Date children
+
+    Returns
+    -------
+    None
+    """
+    for date in element.findall('Date'):
+        if date.find('Type').attrib.get('value') == 'Legal':
+            try:
+                row['legal_start_date'] = \
+                    convert_string_to_date(date.find('Start').attrib.get('value'))
+            except:
+                pass
+            try:
+                row['legal_end_date'] = \
+                    convert_string_to_date(date.find('End').attrib.get('value'))
+            except:
+                pass
+
+        elif date.find('Type').attrib.get('value') == 'Operational':
+            try:
+                row['operational_start_date'] = \
+                    convert_string_to_date(date.find('Start').attrib.get('value'))
+            except:
+                pass
+            try:
+                row['operational_end_date'] = \
+                    convert_string_to_date(date.find('End').attrib.get('value'))
+            except:
+                pass
+
+
+def create_roles(organisation, organisation_xml):
+    """Creates the role rows of an organisation
+
+    Parameters
+    ----------
+    organisation = row dictionary of the organisation
+    organisation_xml = xml element of the full organisation
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples
+    """
+    roles_xml = organisation_xml.find('Roles')
+    rows = []
+
+    for role_xml in roles_xml:
+
+        role = {
+            'org_odscode': organisation['odscode'],
+            'code': role_xml.attrib.get('id'),
+            'primary_role': bool(role_xml.attrib.get('primaryRole')),
+            'status': role_xml.find('Status').attrib.get('value'),
+            'unique_id': role_xml.attrib.get('uniqueRoleId'),
+            'legal_start_date': None,
+            'legal_end_date': None,
+            'operational_start_date': None,
+            'operational_end_date': None
+        }
+
+        # Add Operational and Legal start/end dates if present
+        add_dates(role, role_xml)
+
+        rows.append((Role.__tablename__, role))
+
+    return rows
+
+
+def create_relationships(organisation, organisation_xml):
+    """Creates the relationship rows of an organisation
+
+    Parameters
+    ----------
+    organisation = row dictionary of the organisation
+    organisation_xml = xml element of the full organisation
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples
+    """
+    relationships_xml = organisation_xml.find('Rels')
+    rows = []
+
+    if relationships_xml is not None:
+
+        for relationship_xml in relationships_xml:
+
+            relationship = {
+                'org_odscode': organisation['odscode'],
+                'code': relationship_xml.attrib.get('id'),
+                'target_odscode': relationship_xml.find(
+                    'Target/OrgId').attrib.get('extension'),
+                'status': relationship_xml.find(
+                    'Status').attrib.get('value'),
+                'unique_id': relationship_xml.attrib.get(
+                    'uniqueRelId'),
+                'legal_start_date': None,
+                'legal_end_date': None,
+                'operational_start_date': None,
+                'operational_end_date': None
+            }
+
+            add_dates(relationship, relationship_xml)
+
+            rows.append((Relationship.__tablename__, relationship))
+
+    return rows
+
+
+def create_addresses(organisation, organisation_xml):
+    """Creates the address rows of an organisation, setting the organisation's
+    post_code from its last address
+
+    Parameters
+    ----------
+    organisation = row dictionary of the organisation
+    organisation_xml = xml element of the full organisation
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples
+    """
+    rows = []
+
+    for location in organisation_xml.findall('GeoLoc/Location'):
+
+        address = {
+            'org_odscode': organisation['odscode'],
+            'address_line1': None,
+            'address_line2': None,
+            'address_line3': None,
+            'town': None,
+            'county': None,
+            'post_code': None,
+            'country': None
+        }
+
+        try:
+            address['address_line1'] = location.find('AddrLn1').text
+        except AttributeError:
+            pass
+
+        try:
+            address['address_line2'] = location.find('AddrLn2').text
+        except AttributeError:
+            pass
+
+        try:
+            address['address_line3'] = location.find('AddrLn3').text
+        except AttributeError:
+            pass
+
+        try:
+            address['town'] = location.find('Town').text
+        except AttributeError:
+            pass
+
+        try:
+            address['county'] = location.find('County').text
+        except AttributeError:
+            pass
+
+        try:
+            address['post_code'] = location.find('PostCode').text
+        except AttributeError:
+            pass
+
+        try:
+            organisation['post_code'] = location.find('PostCode').text
+        except AttributeError:
+            pass
+
+        try:
+            address['country'] = location.find('Country').text
+        except AttributeError:
+            pass
+
+        rows.append((Address.__tablename__, address))
+
+    return rows
+
+
+def create_successors(organisation, organisation_xml):
+    """Creates the successor rows of an organisation
+
+    Parameters
+    ----------
+    organisation = row dictionary of the organisation
+    organisation_xml = xml element of the full organisation
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples
+    """
+    rows = []
+
+    for succ in organisation_xml.findall('Succs/Succ'):
+
+        successor = {
+            'unique_id': succ.attrib.get('uniqueSuccId'),
+            'org_odscode': organisation['odscode'],
+            'legal_start_date': None,
+            'type': None,
+            'target_odscode': None,
+            'target_primary_role_code': None,
+            'target_unique_role_id': None
+        }
+
+        try:
+            successor['legal_start_date'] = \
+                convert_string_to_date(succ.find('Date/Start').attrib.get('value'))
+        except AttributeError:
+            pass
+
+        try:
+            successor['type'] = \
+                succ.find('Type').text
+        except AttributeError:
+            pass
+
+        try:
+            successor['target_odscode'] = \
+                succ.find('Target/OrgId').attrib.get('extension')
+        except AttributeError:
+            pass
+
+        try:
+            successor['target_primary_role_code'] = \
+                succ.find('Target/PrimaryRoleId').attrib.get('id')
+        except AttributeError:
+            pass
+
+        try:
+            successor['target_unique_role_id'] = \
+                succ.find('Target/PrimaryRoleId').attrib.get('uniqueRoleId')
+        except AttributeError:
+            pass
+
+        rows.append((Successor.__tablename__, successor))
+
+    return rows
+
+
+class ODSRefAllocator(object):
+    """Hands out the primary keys of organisations and their child rows from a counter per
+    table, and links each child row to its organisation's key. Assigning the keys here, rather
+    than leaving them to the database, means the rows can be written in bulk without fetching
+    any generated keys back
+
+    """
+
+    def __init__(self, next_refs=None):
+        self.__next_refs = dict((table_name, 1) for table_name in allocated_ref_columns)
+        self.__next_refs.update(next_refs or {})
+
+    def assign(self, rows):
+        """Sets the keys of the rows of one organisation
+
+        Parameters
+        ----------
+        rows = the extract_organisation() rows of the organisation, which start with the organisation itself
+
+        Returns
+        -------
+        None
+        """
+        organisation_ref = None
+
+        for table_name, row in rows:
+            ref = self.__next_refs[table_name]
+            self.__next_refs[table_name] = ref + 1
+            row[allocated_ref_columns[table_name]] = ref
+
+            if table_name == Organisation.__tablename__:
+                organisation_ref = ref
+            else:
+                row['organisation_ref'] = organisation_ref
+
+
+def init_worker(code_system_dict, extract=extract_organisation):
+    """Initialiser for extraction worker processes
+
+    Parameters
+    ----------
+    code_system_dict = dictionary of code system id to display name
+    extract = the function to extract each organisation with, which takes the same arguments as extract_organisation()
+
+    Returns
+    -------
+    None
+    """
+    global _worker_code_system_dict, _worker_extract
+    _worker_code_system_dict = code_system_dict
+    _worker_extract = extract
+
+
+def extract_serialised_organisations(serialised_organisations):
+    """Extracts the rows for a chunk of organisations in a worker process.
+    The elements are passed as serialised xml as lxml elements cannot be pickled
+
+    Parameters
+    ----------
+    serialised_organisations = list of Organisation elements serialised with etree.tostring()
+
+    Returns
+    -------
+    List: the extract_organisation() rows of each organisation, in the order given
+    """
+    return [_worker_extract(xml_tree_parser.fromstring(serialised_organisation), _worker_code_system_dict)
+            for serialised_organisation in serialised_organisations]
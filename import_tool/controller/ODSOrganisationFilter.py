@@ -0,0 +1,117 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class ODSOrganisationFilter(object):
+    """Picks the organisations to import by their primary role, status, record class, postcode and
+    last change date, so that a subset of the data can be imported. Each organisation is checked
+    before any of its rows are extracted, looking at as little of the element as possible, and
+    an organisation has to pass every filter which is set
+
+    """
+
+    def __init__(self, primary_roles=None, statuses=None, record_classes=None, postcode_prefixes=None,
+                 changed_since=None):
+        """
+        Parameters
+        ----------
+        primary_roles: codes of the primary roles to import, e.g. RO177
+        statuses: statuses to import, e.g. Active
+        record_classes: record classes to import, by code (RC1) or name (HSCOrg)
+        postcode_prefixes: the start of the postcodes to import, e.g. LS1 or 'LS1 '
+        changed_since: only import organisations last changed on or after this date, as YYYY-MM-DD
+        """
+        self.primary_roles = set(primary_roles) if primary_roles else None
+        self.statuses = set(statuses) if statuses else None
+        self.record_classes = set(record_classes) if record_classes else None
+        self.postcode_prefixes = tuple(prefix.upper() for prefix in postcode_prefixes) if postcode_prefixes else None
+        self.changed_since = changed_since
+
+    def is_set(self):
+        return any(option is not None for option in self.options().values())
+
+    def options(self):
+        """Returns the filters, e.g. to key the row cache with"""
+        return {
+            'primary_roles': sorted(self.primary_roles) if self.primary_roles else None,
+            'statuses': sorted(self.statuses) if self.statuses else None,
+            'record_classes': sorted(self.record_classes) if self.record_classes else None,
+            'postcode_prefixes': sorted(self.postcode_prefixes) if self.postcode_prefixes else None,
+            'changed_since': self.changed_since,
+        }
+
+    def matches(self, organisation_xml, code_system_dict):
+        """Checks an organisation against the filters, cheapest first
+
+        Parameters
+        ----------
+        organisation_xml = xml element of the organisation
+        code_system_dict = the codesystem display names, by code
+
+        Returns
+        -------
+        Boolean: whether the organisation is to be imported
+        """
+        if self.record_classes is not None:
+            record_class = organisation_xml.attrib.get('orgRecordClass')
+
+            if record_class not in self.record_classes and \
+                    code_system_dict.get(record_class) not in self.record_classes:
+                return False
+
+        if self.statuses is not None:
+            status = organisation_xml.find('Status')
+
+            if status is None or status.attrib.get('value') not in self.statuses:
+                return False
+
+        if self.changed_since is not None:
+            last_changed = organisation_xml.find('LastChangeDate')
+
+            # The dates are all YYYY-MM-DD, so compare as text
+            if last_changed is None or (last_changed.attrib.get('value') or '').strip() < self.changed_since:
+                return False
+
+        if self.primary_roles is not None:
+            primary_role = organisation_xml.find('Roles/Role[@primaryRole="true"]')
+
+            if primary_role is None or primary_role.attrib.get('id') not in self.primary_roles:
+                return False
+
+        if self.postcode_prefixes is not None:
+            # The organisation's post_code is that of its last address with one, as the extractor sets it
+            post_code = None
+
+            for location in organisation_xml.iterfind('GeoLoc/Location'):
+                location_post_code = location.find('PostCode')
+
+                if location_post_code is not None:
+                    post_code = location_post_code
+
+            if post_code is None or not (post_code.text or '').upper().startswith(self.postcode_prefixes):
+                return False
+
+        return True
+
+    def filter(self, organisations, code_system_dict):
+        """Filters a stream of organisations
+
+        Parameters
+        ----------
+        organisations = iterable of Organisation elements
+        code_system_dict = the codesystem display names, by code
+
+        Returns
+        -------
+        Generator: the Organisation elements which pass the filters
+        """
+        skipped_count = 0
+
+        for organisation_xml in organisations:
+            if self.matches(organisation_xml, code_system_dict):
+                yield organisation_xml
+            else:
+                skipped_count += 1
+
+        log.debug("Filtered out %s organisations" % skipped_count)
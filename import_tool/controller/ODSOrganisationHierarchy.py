@@ -0,0 +1,62 @@
+import collections
+import logging
+
+from import_tool.models.OrganisationHierarchy import OrganisationHierarchy
+
+log = logging.getLogger(__name__)
+
+# The status of the relationships which make up the hierarchy
+active_status = 'Active'
+
+
+def create_organisation_hierarchy(relationships):
+    """Builds the closure of the active relationships of each type, giving every organisation a
+    row for each organisation above it, however far up. An organisation reached by several routes
+    only gets a row for the shortest, and a relationship leading back to an organisation already
+    on the route is ignored
+
+    Parameters
+    ----------
+    relationships = dictionary of odscode to the (relationship code, target odscode) of the
+    organisation's active relationships
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples
+    """
+    # An adjacency index for each relationship code, from each organisation to those directly above it
+    parents_by_code = collections.defaultdict(lambda: collections.defaultdict(list))
+
+    for odscode, links in relationships.items():
+        for code, target_odscode in links:
+            parents_by_code[code][odscode].append(target_odscode)
+
+    rows = []
+
+    for code in sorted(parents_by_code):
+        parents = parents_by_code[code]
+
+        for odscode in sorted(parents):
+            depths = {odscode: 0}
+            queue = collections.deque([odscode])
+
+            while queue:
+                current = queue.popleft()
+
+                for ancestor in parents.get(current, ()):
+                    if ancestor in depths:
+                        continue
+
+                    depths[ancestor] = depths[current] + 1
+                    queue.append(ancestor)
+
+                    rows.append((OrganisationHierarchy.__tablename__, {
+                        'relationship_code': code,
+                        'ancestor_odscode': ancestor,
+                        'descendant_odscode': odscode,
+                        'depth': depths[ancestor]
+                    }))
+
+    log.debug("Built %s hierarchy rows from %s relationship types" % (len(rows), len(parents_by_code)))
+
+    return rows
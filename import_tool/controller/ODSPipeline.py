@@ -0,0 +1,178 @@
+import collections
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Number of items each queue between two stages can hold before the stage feeding it has to wait
+DEFAULT_QUEUE_SIZE = 8
+
+# How often a stage waiting on a queue checks whether the pipeline has been stopped
+poll_interval = 0.1
+
+
+class PipelineStopped(Exception):
+    """Raised inside a stage's thread when the pipeline is stopped before it has finished"""
+
+
+class _EndOfStream(object):
+    """Placed on a queue after the last item of a stage"""
+
+
+class _StageFailed(object):
+    """Passes an exception raised in a stage down the pipeline to be re-raised by the consumer"""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class ODSPipeline(object):
+    """Runs a chain of stages, each on its own thread, connected by bounded queues so that a
+    fast stage waits for a slow one rather than filling memory. A stage is a function taking
+    an iterable of its predecessor's items and returning an iterable of its own, and the items
+    of the last stage are consumed on the calling thread.
+
+    For each stage the time spent waiting for input (the stage upstream is too slow) and
+    waiting to hand on output (the stage downstream is too slow) is recorded in stats, along
+    with the depth of the queue it feeds
+
+    """
+
+    def __init__(self, source, queue_size=DEFAULT_QUEUE_SIZE):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages = []
+        self.stats = collections.OrderedDict()
+
+        self.__stopped = threading.Event()
+
+    def add_stage(self, name, function):
+        """Adds a stage to the end of the pipeline
+
+        Parameters
+        ----------
+        name: the name to record the stage's stats under
+        function: function turning an iterable of input items into an iterable of output items
+
+        Returns
+        -------
+        ODSPipeline: this pipeline
+        """
+        self.stages.append((name, function))
+        return self
+
+    def run(self, consumer_name):
+        """Starts the stages and yields the items of the last one
+
+        Parameters
+        ----------
+        consumer_name: the name to record the stats of the code consuming the items under
+
+        Returns
+        -------
+        Generator: the items of the last stage. Any exception raised by a stage is re-raised from here
+        """
+        stats = [self.__new_stats(name) for name, function in self.stages]
+        consumer_stats = self.__new_stats(consumer_name)
+
+        queues = [queue.Queue(self.queue_size) for stage in self.stages]
+        threads = []
+
+        for index, (name, function) in enumerate(self.stages):
+            if index == 0:
+                upstream = iter(self.source)
+            else:
+                upstream = self.__iterate_queue(queues[index - 1], stats[index])
+
+            threads.append(threading.Thread(target=self.__run_stage, args=(function, upstream, queues[index],
+                                                                           stats[index]),
+                                            name='pipeline-%s' % name, daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in self.__iterate_queue(queues[-1], consumer_stats) if queues else self.source:
+                consumer_stats['items'] += 1
+                yield item
+
+        finally:
+            # Let any stages which are still running know that nobody is waiting for their output
+            self.__stopped.set()
+
+            for thread in threads:
+                thread.join()
+
+            log.debug("Pipeline stats: %s" % dict(self.stats))
+
+    def __new_stats(self, name):
+        self.stats[name] = {
+            'items': 0,
+            'input_wait_seconds': 0.0,
+            'output_wait_seconds': 0.0,
+            'max_queue_depth': 0,
+            'mean_queue_depth': 0.0,
+        }
+        return self.stats[name]
+
+    def __run_stage(self, function, upstream, output, stats):
+        try:
+            for item in function(upstream):
+                self.__put(output, item, stats)
+
+            self.__put(output, _EndOfStream, stats)
+
+        except PipelineStopped:
+            pass
+
+        except Exception as e:
+            try:
+                self.__put(output, _StageFailed(e), stats)
+            except PipelineStopped:
+                pass
+
+    def __put(self, output, item, stats):
+        wait_start = time.perf_counter()
+
+        while True:
+            try:
+                output.put(item, timeout=poll_interval)
+                break
+            except queue.Full:
+                if self.__stopped.is_set():
+                    raise PipelineStopped()
+
+        stats['output_wait_seconds'] += time.perf_counter() - wait_start
+
+        if item is not _EndOfStream:
+            stats['items'] += 1
+
+            depth = output.qsize()
+            stats['max_queue_depth'] = max(stats['max_queue_depth'], depth)
+            stats['mean_queue_depth'] += (depth - stats['mean_queue_depth']) / stats['items']
+
+    def __iterate_queue(self, input_queue, stats):
+        """Yields the items of a queue until the stage feeding it ends, recording how long the
+        stage reading it waited for them"""
+        while True:
+            wait_start = time.perf_counter()
+
+            while True:
+                try:
+                    item = input_queue.get(timeout=poll_interval)
+                    break
+                except queue.Empty:
+                    if self.__stopped.is_set():
+                        raise PipelineStopped()
+
+            stats['input_wait_seconds'] += time.perf_counter() - wait_start
+
+            if item is _EndOfStream:
+                return
+
+            if isinstance(item, _StageFailed):
+                raise item.exception
+
+            yield item
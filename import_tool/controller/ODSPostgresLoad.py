@@ -0,0 +1,106 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+# Settings for every connection during a bulk load, so the deferred indexes are built with plenty
+# of memory and several workers each
+bulk_load_settings = [
+    ('maintenance_work_mem', "'1GB'"),
+    ('max_parallel_maintenance_workers', 4),
+]
+
+
+def set_bulk_load_settings(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+
+    for setting, value in bulk_load_settings:
+        cursor.execute('SET %s = %s' % (setting, value))
+
+    cursor.close()
+    # psycopg2 has opened a transaction, which would undo the settings if it were rolled back
+    dbapi_connection.commit()
+
+
+def dependency_levels(metadata):
+    """Groups the tables so that every table a table references is in an earlier group
+
+    Parameters
+    ----------
+    metadata: the tables
+
+    Returns
+    -------
+    List: lists of tables
+    """
+    levels = {}
+
+    for table in metadata.sorted_tables:
+        referenced_levels = [levels[foreign_key.column.table] for foreign_key in table.foreign_keys
+                             if foreign_key.column.table is not table]
+        levels[table] = max(referenced_levels) + 1 if referenced_levels else 0
+
+    return [[table for table in metadata.sorted_tables if levels[table] == level]
+            for level in range(max(levels.values()) + 1)] if levels else []
+
+
+class ODSPostgresLoad(object):
+    """Loads a PostgreSQL database without writing the rows to the WAL. The tables are switched to
+    UNLOGGED for the load, then back to logged and analyzed once it is complete, when each table is
+    written to the WAL in one go rather than row by row. Connections are given more memory and
+    workers for building the indexes
+
+    """
+
+    def __init__(self, engine):
+        if engine.dialect.name != 'postgresql':
+            raise ValueError("The bulk load profile is only available for PostgreSQL")
+
+        self.engine = engine
+
+        # The engine may be kept for more imports, which only need the settings made once
+        if not event.contains(self.engine, 'connect', set_bulk_load_settings):
+            event.listen(self.engine, 'connect', set_bulk_load_settings)
+
+    def start(self, metadata):
+        """Makes the tables UNLOGGED, which should be done whilst they are empty
+
+        Parameters
+        ----------
+        metadata: the tables being loaded
+
+        Returns
+        -------
+        None
+        """
+        # A logged table cannot reference an unlogged one, so the referencing tables go first
+        with self.engine.begin() as connection:
+            for table in reversed(metadata.sorted_tables):
+                log.debug("Setting %s unlogged" % table.name)
+                connection.execute('ALTER TABLE %s SET UNLOGGED' % table.name)
+
+    def finish(self, metadata):
+        """Makes the tables logged again and analyzes them, each table on its own connection
+
+        Parameters
+        ----------
+        metadata: the tables being loaded
+
+        Returns
+        -------
+        None
+        """
+        # Likewise an unlogged table cannot be referenced by a logged one, so the referenced tables go first
+        for tables in dependency_levels(metadata):
+            with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+                # list() so that any exception raised in a thread is re-raised here
+                list(executor.map(self.__set_logged, tables))
+
+    def __set_logged(self, table):
+        log.debug("Setting %s logged" % table.name)
+
+        with self.engine.begin() as connection:
+            connection.execute('ALTER TABLE %s SET LOGGED' % table.name)
+            connection.execute('ANALYZE %s' % table.name)
@@ -0,0 +1,208 @@
+import gzip
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+log = logging.getLogger(__name__)
+
+# Bump this whenever the extracted rows or the file layout change so that old entries are ignored
+CACHE_FORMAT_VERSION = 2
+
+CACHE_FILE_EXTENSION = '.rows.gz'
+
+DEFAULT_CACHE_SIZE_MB = 2048
+
+
+# Digests already worked out in this process, keyed by file name, size and modification time
+_file_hashes = {}
+
+
+def file_hash(file_name):
+    """Returns the SHA-256 hex digest of a file's contents"""
+    file_stat = os.stat(file_name)
+    memo_key = (os.path.abspath(file_name), file_stat.st_size, file_stat.st_mtime)
+
+    if memo_key not in _file_hashes:
+        digest = hashlib.sha256()
+
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+
+        _file_hashes[memo_key] = digest.hexdigest()
+
+    return _file_hashes[memo_key]
+
+
+class ODSRowCache(object):
+    """A directory of previously extracted rows, keyed by the content of the data and schema
+    zip files they were extracted from. Each entry is a gzipped stream of pickled chunks,
+    every chunk holding a batch of one table's rows stored column by column. The directory
+    is kept under a maximum size by evicting the least recently used entries
+
+    """
+
+    def __init__(self, cache_dir, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, data_filename, schema_filename, options=None):
+        """Works out the cache key for a pair of input files
+
+        Parameters
+        ----------
+        data_filename: the zip file containing the xml
+        schema_filename: the zip file containing the xsd
+        options: dictionary of any other settings which change the extracted rows
+
+        Returns
+        -------
+        String: the cache key
+        """
+        digest = hashlib.sha256()
+        digest.update(str(CACHE_FORMAT_VERSION).encode())
+        digest.update(file_hash(data_filename).encode())
+        digest.update(file_hash(schema_filename).encode())
+        digest.update(repr(sorted((options or {}).items())).encode())
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXTENSION)
+
+    def get(self, key):
+        """Looks up a cache entry, marking it as recently used
+
+        Parameters
+        ----------
+        key: the cache key from key()
+
+        Returns
+        -------
+        String: the path of the cached rows, or None if they are not cached
+        """
+        cache_file = self.path(key)
+
+        if not os.path.isfile(cache_file):
+            log.debug("Cache miss for %s" % key)
+            return None
+
+        log.debug("Cache hit for %s" % key)
+        os.utime(cache_file, None)
+        return cache_file
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits within its maximum size"""
+        entries = []
+
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(CACHE_FILE_EXTENSION):
+                entry = os.path.join(self.cache_dir, file_name)
+                entries.append((os.path.getmtime(entry), os.path.getsize(entry), entry))
+
+        total_size = sum(size for mtime, size, entry in entries)
+
+        for mtime, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            log.debug("Evicting %s from the cache" % entry)
+            os.remove(entry)
+            total_size -= size
+
+
+def read_cached_rows(cache_file):
+    """Reads back the rows of a cache entry in the order they were recorded
+
+    Parameters
+    ----------
+    cache_file: path of the cache entry
+
+    Returns
+    -------
+    Generator: (table name, row dictionary) tuples
+    """
+    with gzip.open(cache_file, 'rb') as f:
+        while True:
+            try:
+                table_name, column_names, columns = pickle.load(f)
+            except EOFError:
+                break
+
+            for values in zip(*columns):
+                yield table_name, dict(zip(column_names, values))
+
+
+class ODSCacheRecorder(object):
+    """Wraps a writer, passing everything through to it whilst also recording the rows
+    into a new cache entry. The entry only appears in the cache once the import commits
+
+    """
+
+    def __init__(self, writer, row_cache, key, batch_size):
+        self.writer = writer
+        self.connection = writer.connection
+        self.row_cache = row_cache
+        self.key = key
+        self.batch_size = batch_size
+
+        self.__columns = {}
+        self.__counts = {}
+
+        file_descriptor, self.__temp_file = tempfile.mkstemp(dir=row_cache.cache_dir, suffix='.tmp')
+        self.__raw_file = os.fdopen(file_descriptor, 'wb')
+        self.__cache_file = gzip.GzipFile(fileobj=self.__raw_file, mode='wb', compresslevel=1)
+
+    def add(self, table_name, row):
+        if table_name not in self.__columns:
+            self.__columns[table_name] = (list(row), [[] for _ in row])
+            self.__counts[table_name] = 0
+
+        column_names, columns = self.__columns[table_name]
+        for column_name, column in zip(column_names, columns):
+            column.append(row[column_name])
+
+        self.__counts[table_name] += 1
+        if self.__counts[table_name] >= self.batch_size:
+            self.__write_chunk(table_name)
+
+        self.writer.add(table_name, row)
+
+    def __write_chunk(self, table_name):
+        column_names, columns = self.__columns.pop(table_name)
+        pickle.dump((table_name, column_names, columns), self.__cache_file, pickle.HIGHEST_PROTOCOL)
+
+    def delete(self, table_name, column_name, value):
+        self.writer.delete(table_name, column_name, value)
+
+    def flush(self):
+        self.writer.flush()
+
+    def commit(self):
+        self.writer.commit()
+
+        for table_name in list(self.__columns):
+            self.__write_chunk(table_name)
+
+        # Closing the GzipFile does not close the file object underneath it
+        self.__cache_file.close()
+        self.__raw_file.close()
+        os.rename(self.__temp_file, self.row_cache.path(self.key))
+        log.debug("Cached rows as %s" % self.key)
+
+        self.row_cache.evict()
+
+    def rollback(self):
+        self.writer.rollback()
+
+        self.__cache_file.close()
+        self.__raw_file.close()
+        os.remove(self.__temp_file)
+
+    def close(self):
+        self.writer.close()
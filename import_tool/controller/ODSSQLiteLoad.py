@@ -0,0 +1,130 @@
+import logging
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import create_engine, event
+
+log = logging.getLogger(__name__)
+
+# Pragmas set on every connection during a fast load. The journal is kept in memory rather than
+# turned off so that a failed import can still be rolled back
+fast_load_pragmas = [
+    ('page_size', 65536),
+    ('journal_mode', 'MEMORY'),
+    ('synchronous', 'OFF'),
+    # negative sizes are in KB, so this is a 512MB page cache
+    ('cache_size', -512 * 1024),
+    ('temp_store', 'MEMORY'),
+]
+
+
+def copy_file_mode(database_file, temp_file):
+    """Gives the temporary file the database's permissions before it replaces it, as mkstemp makes it
+    readable by its owner alone. A new database gets those of any new file
+
+    Parameters
+    ----------
+    database_file: the database the temporary file is to replace, which may not exist yet
+    temp_file: the temporary file
+
+    Returns
+    -------
+    None
+    """
+    if os.path.isfile(database_file):
+        shutil.copymode(database_file, temp_file)
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_file, 0o666 & ~umask)
+
+
+def set_fast_load_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+
+    for pragma, value in fast_load_pragmas:
+        cursor.execute('PRAGMA %s = %s' % (pragma, value))
+
+    cursor.close()
+
+
+class ODSSQLiteLoad(object):
+    """Loads a SQLite database as quickly as possible. The fast profile turns off fsync and
+    keeps the journal in memory for the duration of the import, then analyzes and vacuums the
+    result. With atomic set the import is written to a temporary file beside the database,
+    which is only renamed over it once the import has finished, so readers of the database
+    never see a partial import. A temporary file starts as a copy of the database, unless
+    start_empty is set for a load which replaces the whole database
+
+    """
+
+    def __init__(self, engine, fast_load=False, atomic=False, start_empty=False):
+        self.database_file = engine.url.database
+        self.fast_load = fast_load
+        self.temp_file = None
+
+        if atomic:
+            if not self.database_file or self.database_file == ':memory:':
+                raise ValueError("Only a SQLite database file can be loaded atomically")
+
+            file_descriptor, self.temp_file = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.database_file)),
+                prefix=os.path.basename(self.database_file) + '.', suffix='.tmp')
+            os.close(file_descriptor)
+
+            # An incremental import updates the existing data, so start from a copy of it
+            if os.path.isfile(self.database_file) and not start_empty:
+                shutil.copyfile(self.database_file, self.temp_file)
+
+            log.debug("Loading into %s" % self.temp_file)
+            engine.dispose()
+            self.engine = create_engine('sqlite:///%s' % self.temp_file)
+
+        else:
+            self.engine = engine
+
+        # The engine may be kept for more imports, which only need the pragmas set once
+        if fast_load and not event.contains(self.engine, 'connect', set_fast_load_pragmas):
+            event.listen(self.engine, 'connect', set_fast_load_pragmas)
+
+    def finish(self, optimize=False):
+        """Optimises the loaded database and, if loading atomically, moves it into place
+
+        Parameters
+        ----------
+        optimize: also run PRAGMA optimize
+
+        Returns
+        -------
+        None
+        """
+        if self.fast_load:
+            with self.engine.connect() as connection:
+                log.debug("Analyzing database")
+                connection.execute('ANALYZE')
+
+                # This also applies the larger page size to a database which already existed
+                log.debug("Vacuuming database")
+                connection.execute('VACUUM')
+
+        if optimize:
+            with self.engine.connect() as connection:
+                log.debug("Optimizing database")
+                connection.execute('PRAGMA optimize')
+
+        self.engine.dispose()
+
+        if self.temp_file is not None:
+            copy_file_mode(self.database_file, self.temp_file)
+            os.replace(self.temp_file, self.database_file)
+            log.debug("Moved the import into place at %s" % self.database_file)
+            self.temp_file = None
+
+    def discard(self):
+        """Throws away a failed atomic load, leaving the original database untouched"""
+        self.engine.dispose()
+
+        if self.temp_file is not None:
+            os.remove(self.temp_file)
+            self.temp_file = None
@@ -0,0 +1,71 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# The table holding the search index, which is rebuilt from scratch by every import
+search_table = 'organisation_search'
+
+# The address columns searched along with the organisation's name
+searched_address_columns = ['address_line1', 'address_line2', 'address_line3', 'town', 'post_code']
+
+# Prefix indexes make "starts with" searches of short terms as quick as whole words
+sqlite_statements = [
+    'DROP TABLE IF EXISTS {table}',
+    "CREATE VIRTUAL TABLE {table} USING fts5(odscode UNINDEXED, name, address, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "INSERT INTO {table} (rowid, odscode, name, address) "
+    "SELECT organisations.ref, organisations.odscode, organisations.name, "
+    "(SELECT group_concat({address}, ' ') FROM addresses WHERE addresses.organisation_ref = organisations.ref) "
+    "FROM organisations",
+]
+
+# The simple configuration neither stems words nor drops stop words, which suits names and postcodes
+postgresql_statements = [
+    'DROP TABLE IF EXISTS {table}',
+    "CREATE TABLE {table} AS "
+    "SELECT organisations.ref AS organisation_ref, organisations.odscode, "
+    "setweight(to_tsvector('simple', coalesce(organisations.name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce((SELECT string_agg({address}, ' ') FROM addresses "
+    "WHERE addresses.organisation_ref = organisations.ref), '')), 'B') AS document "
+    "FROM organisations",
+    'CREATE UNIQUE INDEX ix_{table}_organisation_ref ON {table} (organisation_ref)',
+    'CREATE INDEX ix_{table}_document ON {table} USING gin (document)',
+    'ANALYZE {table}',
+]
+
+
+def sqlite_has_fts5(connection):
+    return ('ENABLE_FTS5',) in connection.execute('PRAGMA compile_options').fetchall()
+
+
+def build_search_index(engine):
+    """Builds the full text index of organisation names and addresses in one pass over the loaded
+    tables. SQLite gets an FTS5 table, PostgreSQL a table of tsvector documents with a GIN index,
+    each keyed by the organisation's ref
+
+    Parameters
+    ----------
+    engine: the SQLAlchemy engine of the loaded database
+
+    Returns
+    -------
+    None
+    """
+    if engine.dialect.name == 'sqlite':
+        statements = sqlite_statements
+        # concat_ws() only arrived in SQLite 3.44
+        address = " || ' ' || ".join("coalesce(addresses.%s, '')" % column for column in searched_address_columns)
+    elif engine.dialect.name == 'postgresql':
+        statements = postgresql_statements
+        address = "concat_ws(' ', %s)" % ', '.join('addresses.%s' % column for column in searched_address_columns)
+    else:
+        raise ValueError("A search index cannot be built for %s" % engine.dialect.name)
+
+    with engine.begin() as connection:
+        if engine.dialect.name == 'sqlite' and not sqlite_has_fts5(connection):
+            raise ValueError("The search index needs a SQLite library built with FTS5")
+
+        log.debug("Building the %s search index" % engine.dialect.name)
+
+        for statement in statements:
+            connection.execute(statement.format(table=search_table, address=address))
@@ -0,0 +1,161 @@
+import logging
+
+from sqlalchemy import create_engine, func, select
+
+from import_tool.models.Organisation import Organisation
+from import_tool.models.Version import Version
+
+log = logging.getLogger(__name__)
+
+# Renaming public away would take everything else in it, such as extensions, with it
+reserved_schemas = ('public',)
+
+
+def check_record_count(engine):
+    """Checks that every organisation the data file's Manifest counts has been loaded
+
+    Parameters
+    ----------
+    engine: the SQLAlchemy engine of the loaded database
+
+    Returns
+    -------
+    None
+    """
+    versions = Version.__table__
+
+    with engine.connect() as connection:
+        record_count = connection.execute(select([versions.c.record_count])
+                                          .order_by(versions.c.version_ref.desc()).limit(1)).scalar()
+        organisation_count = connection.execute(select([func.count()]).select_from(Organisation.__table__)).scalar()
+
+    if record_count is None or int(record_count) != organisation_count:
+        raise ValueError("The Manifest's RecordCount is %s but %s organisations were loaded"
+                         % (record_count, organisation_count))
+
+    log.debug("Loaded all %s organisations" % organisation_count)
+
+
+class ODSShadowLoad(object):
+    """Loads a PostgreSQL database into a staging schema alongside the live one, then swaps it in
+    by renaming the schemas in a single transaction. Readers of the live schema carry on with the
+    previous import until the swap, and never see a partial one. The live schema is replaced as a
+    whole, so it has to be a dedicated one which only holds the import's tables
+
+    """
+
+    def __init__(self, engine, live_schema):
+        if engine.dialect.name != 'postgresql':
+            raise ValueError("Only a PostgreSQL database can be loaded into a staging schema")
+
+        if not live_schema or live_schema.lower() in reserved_schemas:
+            raise ValueError("A shadow load replaces the whole of the live schema, which has to be a dedicated one "
+                             "rather than %s" % (live_schema or 'the default'))
+
+        self.live_engine = engine
+        self.live_schema = live_schema
+        self.staging_schema = live_schema + '_staging'
+        self.previous_schema = live_schema + '_previous'
+        # The names are always quoted, so that PostgreSQL does not fold them to lower case and they are
+        # the same names as are looked up in the catalogs
+        self.quote = engine.dialect.identifier_preparer.quote_identifier
+
+        # Whatever a failed load left behind is started again
+        with engine.begin() as connection:
+            connection.execute('DROP SCHEMA IF EXISTS %s CASCADE' % self.quote(self.staging_schema))
+            connection.execute('CREATE SCHEMA %s' % self.quote(self.staging_schema))
+
+        log.debug("Loading into schema %s" % self.staging_schema)
+
+        # Everything the import creates or reads goes to the staging schema
+        # libpq splits the options on spaces which are not escaped with a backslash
+        search_path = self.quote(self.staging_schema).replace('\\', '\\\\').replace(' ', '\\ ')
+        self.engine = create_engine(engine.url, connect_args={'options': '-c search_path=%s' % search_path})
+
+    def swap(self):
+        """Makes the staging schema the live one, then drops the previous live schema
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.engine.dispose()
+
+        with self.live_engine.begin() as connection:
+            live_exists = connection.execute('SELECT 1 FROM pg_namespace WHERE nspname = %(schema)s',
+                                             schema=self.live_schema).scalar()
+
+            connection.execute('DROP SCHEMA IF EXISTS %s CASCADE' % self.quote(self.previous_schema))
+
+            if live_exists:
+                self.copy_privileges(connection)
+                connection.execute('ALTER SCHEMA %s RENAME TO %s'
+                                   % (self.quote(self.live_schema), self.quote(self.previous_schema)))
+
+            connection.execute('ALTER SCHEMA %s RENAME TO %s'
+                               % (self.quote(self.staging_schema), self.quote(self.live_schema)))
+
+        log.debug("Swapped schema %s in as %s" % (self.staging_schema, self.live_schema))
+
+        # Dropping the old tables waits for anyone still reading them, which no longer holds up the import
+        with self.live_engine.begin() as connection:
+            connection.execute('DROP SCHEMA IF EXISTS %s CASCADE' % self.quote(self.previous_schema))
+
+    def copy_privileges(self, connection):
+        """Grants everything granted on the live schema, and on its tables and views, on the staging
+        schema and its tables and views of the same name, so that readers of the live schema can still
+        read it once it has been swapped
+
+        Parameters
+        ----------
+        connection: the connection of the swap's transaction
+
+        Returns
+        -------
+        None
+        """
+        quote = self.quote
+
+        def grant(privilege_type, on, grantee, is_grantable):
+            # The grantee is a role name, or PUBLIC for everyone
+            connection.execute('GRANT %s ON %s TO %s%s' % (
+                privilege_type, on, 'PUBLIC' if grantee in (None, 'PUBLIC') else quote(grantee),
+                ' WITH GRANT OPTION' if is_grantable else ''))
+
+        # Those of the schema's owner are left out, as the importer owns the staging schema
+        schema_grants = connection.execute(
+            'SELECT roles.rolname, acl.privilege_type, acl.is_grantable '
+            'FROM pg_namespace CROSS JOIN LATERAL aclexplode(pg_namespace.nspacl) acl '
+            'LEFT JOIN pg_roles roles ON roles.oid = acl.grantee '
+            'WHERE pg_namespace.nspname = %(schema)s AND acl.grantee <> pg_namespace.nspowner',
+            schema=self.live_schema).fetchall()
+
+        for grantee, privilege_type, is_grantable in schema_grants:
+            grant(privilege_type, 'SCHEMA %s' % quote(self.staging_schema), grantee, is_grantable)
+
+        # Those the owner has of its own tables are left out in the same way
+        table_grants = connection.execute(
+            'SELECT grants.grantee, grants.table_name, grants.privilege_type, grants.is_grantable '
+            'FROM information_schema.role_table_grants grants '
+            'JOIN information_schema.tables staging_tables ON staging_tables.table_name = grants.table_name '
+            'AND staging_tables.table_schema = %(staging_schema)s '
+            'WHERE grants.table_schema = %(schema)s AND grants.grantor <> grants.grantee',
+            schema=self.live_schema, staging_schema=self.staging_schema).fetchall()
+
+        for grantee, table_name, privilege_type, is_grantable in table_grants:
+            grant(privilege_type, 'TABLE %s.%s' % (quote(self.staging_schema), quote(table_name)), grantee,
+                  is_grantable == 'YES')
+
+        log.debug("Copied %s schema and %s table privileges from schema %s"
+                  % (len(schema_grants), len(table_grants), self.live_schema))
+
+    def discard(self):
+        """Throws away a failed load, leaving the live schema untouched"""
+        self.engine.dispose()
+
+        with self.live_engine.begin() as connection:
+            connection.execute('DROP SCHEMA IF EXISTS %s CASCADE' % self.quote(self.staging_schema))
@@ -0,0 +1,87 @@
+import collections
+import logging
+
+from import_tool.models.SuccessorClosure import SuccessorClosure
+
+log = logging.getLogger(__name__)
+
+# The successor type of the links which point forwards in time, from an organisation to the one that replaced it
+successor_link_type = 'Successor'
+
+# Separates the codes in the path column
+path_separator = '>'
+
+
+def create_successor_closure(successors):
+    """Follows every organisation's chain of successors to the organisations it ends at. Each
+    organisation gets a row for every end of its chain, which is an organisation without a
+    successor, or the last organisation before the chain loops back on itself. Where several
+    routes lead to the same end only the shortest is kept
+
+    Parameters
+    ----------
+    successors = dictionary of odscode to the odscodes of the organisation's successors
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples
+    """
+    rows = []
+    cycles = 0
+
+    for odscode in sorted(successors):
+        if not successors[odscode]:
+            continue
+
+        # A breadth first search, so each organisation is reached by its shortest route
+        parents = {odscode: None}
+        queue = collections.deque([odscode])
+
+        while queue:
+            current = queue.popleft()
+            path = _path_to(current, parents)
+            targets = successors.get(current)
+
+            if not targets:
+                rows.append(_closure_row(path, False))
+                continue
+
+            loops = False
+
+            for target in targets:
+                if target not in parents:
+                    parents[target] = current
+                    queue.append(target)
+
+                elif target in path:
+                    # The chain loops back on itself, so it ends here, whilst its other successors carry on
+                    loops = True
+
+            if loops:
+                rows.append(_closure_row(path, True))
+                cycles += 1
+
+    if cycles:
+        log.warning("%s organisations have successor chains which loop back on themselves" % cycles)
+
+    return rows
+
+
+def _path_to(odscode, parents):
+    path = [odscode]
+
+    while parents[path[-1]] is not None:
+        path.append(parents[path[-1]])
+
+    path.reverse()
+    return path
+
+
+def _closure_row(path, cycle):
+    return SuccessorClosure.__tablename__, {
+        'org_odscode': path[0],
+        'ultimate_odscode': path[-1],
+        'depth': len(path) - 1,
+        'path': path_separator.join(path),
+        'cycle': cycle
+    }
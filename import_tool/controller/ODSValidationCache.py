@@ -0,0 +1,74 @@
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+log = logging.getLogger(__name__)
+
+VERDICT_FILE_NAME = 'validation_verdicts.json'
+
+
+class ODSValidationCache(object):
+    """Remembers which data files have already been found to be valid against which schema,
+    so that unchanged inputs do not have to be validated again. The verdicts are kept in a
+    JSON file in the cache directory
+
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.verdict_file = os.path.join(cache_dir, VERDICT_FILE_NAME)
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, data_hash, schema_hash, schema_version):
+        """Works out the verdict key
+
+        Parameters
+        ----------
+        data_hash: SHA-256 of the data zip file
+        schema_hash: SHA-256 of the xsd
+        schema_version: the version declared by the xsd
+
+        Returns
+        -------
+        String: the verdict key
+        """
+        return '%s:%s:%s' % (data_hash, schema_hash, schema_version)
+
+    def __load_verdicts(self):
+        if not os.path.isfile(self.verdict_file):
+            return {}
+
+        with open(self.verdict_file) as f:
+            return json.load(f)
+
+    def is_valid(self, key):
+        return self.__load_verdicts().get(key, {}).get('valid', False)
+
+    def record_valid(self, key):
+        """Records that the data for a key has been validated successfully
+
+        Parameters
+        ----------
+        key: the verdict key from key()
+
+        Returns
+        -------
+        None
+        """
+        verdicts = self.__load_verdicts()
+        verdicts[key] = {
+            'valid': True,
+            'validated': datetime.datetime.now().isoformat()
+        }
+
+        # Write to a temporary file first so a failed write cannot corrupt the existing verdicts
+        file_descriptor, temp_file = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w') as f:
+            json.dump(verdicts, f, indent=2, sort_keys=True)
+
+        os.replace(temp_file, self.verdict_file)
+        log.debug("Recorded validation verdict %s" % key)
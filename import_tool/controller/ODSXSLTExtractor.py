@@ -0,0 +1,236 @@
+import functools
+import threading
+
+from lxml import etree as xml_tree_parser
+
+from import_tool.controller.ODSOrganisationExtractor import convert_string_to_date, extract_organisation
+from import_tool.models.Address import Address
+from import_tool.models.Organisation import Organisation
+from import_tool.models.Relationship import Relationship
+from import_tool.models.Role import Role
+from import_tool.models.Successor import Successor
+
+# The flattened text is split on Unicode noncharacters, which are set aside for use inside a program
+# and so are not expected in the data. A value containing one gives the wrong number of fields, and
+# the organisation is then extracted by the Python extractor instead
+field_separator = '\ufdd0'
+record_separator = '\ufdd1'
+null_value = '\ufdd2'
+# Written at the start of an organisation which is missing an element the Python extractor needs,
+# so that the Python extractor is left to raise its error about it
+missing_element = '\ufdd3'
+
+# How each kind of field is written, given the XPath of its value. An attribute is the null marker
+# when there is no such attribute, as it may also be empty. The other kinds are empty when they have
+# no value: lxml gives no text for an empty element, a date that is empty is skipped in the same way
+# as a missing one, and an empty flag is as false as a missing one
+field_xpaths = {
+    'attribute': "substring('&#xFDD2;', 1, not(%s)), %s",
+    'code': "substring('&#xFDD2;', 1, not(%s)), %s",
+    'text': "%s",
+    'date': "%s",
+    'flag': "%s",
+}
+
+
+def date_fields():
+    # Each Date child sets the dates of its type, so the last Date of a type with a start or an end gives
+    # that date. An empty date is skipped, as it cannot be converted
+    return [(column, 'date', "(Date[Type[1]/@value = '%s']/%s[1]/@value[. != ''])[last()]" % (date_type, end))
+            for column, date_type, end in [('legal_start_date', 'Legal', 'Start'),
+                                           ('legal_end_date', 'Legal', 'End'),
+                                           ('operational_start_date', 'Operational', 'Start'),
+                                           ('operational_end_date', 'Operational', 'End')]]
+
+
+# The records of the flattened text: the letter each one starts with, its table, the elements it is
+# written for and its fields, which are in the same order as the keys of extract_organisation()'s rows.
+# The org_odscode of the child records is left empty and filled in from the organisation's record
+records = [
+    ('o', Organisation.__tablename__, '.', [
+        ('odscode', 'attribute', 'OrgId[1]/@extension'),
+        ('name', 'text', 'Name[1]'),
+        ('status', 'attribute', 'Status[1]/@value'),
+        ('record_class', 'code', '@orgRecordClass'),
+        ('last_changed', 'attribute', 'LastChangeDate[1]/@value'),
+    ] + date_fields() + [
+        ('ref_only', 'flag', '@refOnly'),
+        # Each address with a PostCode sets the organisation's
+        ('post_code', 'text', '(GeoLoc/Location/PostCode[1])[last()]'),
+    ]),
+    ('a', Address.__tablename__, 'GeoLoc/Location', [
+        ('org_odscode', 'organisation', None),
+        ('address_line1', 'text', 'AddrLn1[1]'),
+        ('address_line2', 'text', 'AddrLn2[1]'),
+        ('address_line3', 'text', 'AddrLn3[1]'),
+        ('town', 'text', 'Town[1]'),
+        ('county', 'text', 'County[1]'),
+        ('post_code', 'text', 'PostCode[1]'),
+        ('country', 'text', 'Country[1]'),
+    ]),
+    ('r', Role.__tablename__, 'Roles[1]/*', [
+        ('org_odscode', 'organisation', None),
+        ('code', 'attribute', '@id'),
+        ('primary_role', 'flag', '@primaryRole'),
+        ('status', 'attribute', 'Status[1]/@value'),
+        ('unique_id', 'attribute', '@uniqueRoleId'),
+    ] + date_fields()),
+    ('l', Relationship.__tablename__, 'Rels[1]/*', [
+        ('org_odscode', 'organisation', None),
+        ('code', 'attribute', '@id'),
+        ('target_odscode', 'attribute', '(Target/OrgId)[1]/@extension'),
+        ('status', 'attribute', 'Status[1]/@value'),
+        ('unique_id', 'attribute', '@uniqueRelId'),
+    ] + date_fields()),
+    ('s', Successor.__tablename__, 'Succs/Succ', [
+        ('unique_id', 'attribute', '@uniqueSuccId'),
+        ('org_odscode', 'organisation', None),
+        ('legal_start_date', 'date', '(Date/Start)[1]/@value'),
+        ('type', 'text', 'Type[1]'),
+        ('target_odscode', 'attribute', '(Target/OrgId)[1]/@extension'),
+        ('target_primary_role_code', 'attribute', '(Target/PrimaryRoleId)[1]/@id'),
+        ('target_unique_role_id', 'attribute', '(Target/PrimaryRoleId)[1]/@uniqueRoleId'),
+    ]),
+]
+
+# The table and the columns and kinds of fields of each record, by its letter
+record_formats = dict((letter, (table_name, [(column, kind) for column, kind, path in fields]))
+                      for letter, table_name, elements, fields in records)
+
+# The elements which extract_organisation() cannot do without
+missing_element_test = ' or '.join([
+    'not(OrgId)', 'not(Name)', 'not(Status)', 'not(LastChangeDate)', 'not(Roles)', 'Date[not(Type)]',
+    'Roles[1]/*[not(Status) or Date[not(Type)]]', 'Rels[1]/*[not(Status) or not(Target/OrgId) or Date[not(Type)]]',
+    # A successor's start date is converted without checking that it is there
+    "Succs/Succ[(Date/Start)[1][not(@value) or @value = '']]",
+])
+
+
+def record_xpath(letter, fields):
+    return "concat('%s', %s, '&#xFDD1;')" % (letter, ', '.join(
+        "'&#xFDD0;'" if path is None else "'&#xFDD0;', " + field_xpaths[kind].replace('%s', path)
+        for column, kind, path in fields))
+
+
+# Each record is a single concat(), as libxslt is much slower at variables and template calls
+stylesheet = """<?xml version="1.0" encoding="UTF-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:output method="text" encoding="UTF-8"/>
+
+  <xsl:template match="Organisation">
+    <xsl:if test="%s">&#xFDD3;</xsl:if>
+%s
+  </xsl:template>
+</xsl:stylesheet>
+""" % (missing_element_test, '\n'.join(
+    '    <xsl:for-each select="%s"><xsl:value-of select="%s"/></xsl:for-each>' % (elements, record_xpath(letter, fields))
+    for letter, table_name, elements, fields in records))
+
+# The compiled stylesheet of each thread, as an XSLT object is not to be shared between threads
+_transforms = threading.local()
+
+
+def get_transform():
+    """Returns this thread's compiled stylesheet, compiling it on first use"""
+    transform = getattr(_transforms, 'transform', None)
+
+    if transform is None:
+        transform = xml_tree_parser.XSLT(xml_tree_parser.fromstring(stylesheet.encode('utf-8')))
+        _transforms.transform = transform
+
+    return transform
+
+
+def flatten_organisation(organisation_xml):
+    """Flattens an Organisation element and its roles, relationships, addresses and successors
+    into delimited text with the stylesheet
+
+    Parameters
+    ----------
+    organisation_xml = xml element of the full organisation
+
+    Returns
+    -------
+    String: a record per row, each starting with a letter from record_formats saying which table it is for
+    """
+    return str(get_transform()(organisation_xml))
+
+
+def extract_organisation_with_xslt(organisation_xml, code_system_dict):
+    """Turns a single Organisation element into the same rows as extract_organisation(), with the
+    elements read by libxslt rather than in Python. An organisation which the flattened text cannot
+    represent is handed to extract_organisation()
+
+    Parameters
+    ----------
+    organisation_xml = xml element of the full organisation
+    code_system_dict = dictionary of code system id to display name
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples in the order they should be written
+    """
+    flattened = flatten_organisation(organisation_xml)
+
+    if flattened.startswith(missing_element):
+        return extract_organisation(organisation_xml, code_system_dict)
+
+    try:
+        return rows_from_flattened(flattened, code_system_dict)
+    except ValueError:
+        # An unexpected separator or a date the Python extractor may skip
+        return extract_organisation(organisation_xml, code_system_dict)
+
+
+@functools.lru_cache(maxsize=65536)
+def convert_cached_date(string):
+    """convert_string_to_date() of the dates which have already been seen, as the same few thousand
+    dates are used throughout the data"""
+    return convert_string_to_date(string)
+
+
+def rows_from_flattened(flattened, code_system_dict):
+    """Builds the rows of an organisation from its flattened text
+
+    Parameters
+    ----------
+    flattened = the flatten_organisation() text of the organisation
+    code_system_dict = dictionary of code system id to display name
+
+    Returns
+    -------
+    List: (table name, row dictionary) tuples in the order they should be written
+    """
+    rows = []
+    odscode = None
+
+    # The text ends with a record separator
+    for record in flattened.split(record_separator)[:-1]:
+        fields = record.split(field_separator)
+        table_name, columns = record_formats[fields[0]]
+
+        if len(fields) != len(columns) + 1:
+            raise ValueError("Expected %s fields in a %s record" % (len(columns), table_name))
+
+        row = {}
+
+        for (column, kind), value in zip(columns, fields[1:]):
+            if kind == 'attribute':
+                row[column] = None if value == null_value else value
+            elif kind == 'text':
+                row[column] = value or None
+            elif kind == 'date':
+                row[column] = convert_cached_date(value) if value else None
+            elif kind == 'flag':
+                row[column] = bool(value)
+            elif kind == 'code':
+                row[column] = code_system_dict[None if value == null_value else value]
+            else:
+                row[column] = odscode
+
+        if table_name == Organisation.__tablename__:
+            odscode = row['odscode']
+
+        rows.append((table_name, row))
+
+    return rows
@@ -1,7 +1,7 @@
 import sys
 
 import os.path
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String
 
 # setup path so we can import our own models and controllers
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
@@ -18,6 +18,7 @@ class Address(Base):
     __tablename__ = 'addresses'
 
     addresses_ref = Column(Integer, primary_key=True)
+    organisation_ref = Column(Integer, ForeignKey('organisations.ref'), index=True)
     org_odscode = Column(String(10), index=True)
     address_line1 = Column(String(75))
     address_line2 = Column(String(75))
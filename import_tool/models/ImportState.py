@@ -0,0 +1,34 @@
+import sys
+
+import os.path
+from sqlalchemy import Column, Integer, String
+
+# setup path so we can import our own models and controllers
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from import_tool.models.base import Base
+
+
+class ImportState(Base):
+    """
+    ImportState class that keeps track of how far a checkpointed import
+    of a data file has got, so that it can be resumed if it fails. The row
+    is removed once the import has finished. This class uses SQLAlchemy
+    as an ORM
+
+    """
+    __tablename__ = 'import_state'
+
+    data_file_hash = Column(String(64), primary_key=True)
+    last_odscode = Column(String(10))
+    organisation_count = Column(Integer)
+    checkpoint_timestamp = Column(String)
+
+    # Returns a printable version of the objects contents
+    def __repr__(self):
+        return "<ImportState(%s %s %s %s)>" \
+            % (
+                self.data_file_hash,
+                self.last_odscode,
+                self.organisation_count,
+                self.checkpoint_timestamp)
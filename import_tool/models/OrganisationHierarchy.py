@@ -0,0 +1,41 @@
+import sys
+
+import os.path
+from sqlalchemy import Column, Index, Integer, String
+
+# setup path so we can import our own models and controllers
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from import_tool.models.base import Base
+
+
+class OrganisationHierarchy(Base):
+    """
+    OrganisationHierarchy class that keeps track of every organisation above
+    an organisation through its active relationships of each type, so the
+    whole of a hierarchy can be read without walking it. This class uses
+    SQLAlchemy as an ORM
+
+    """
+    __tablename__ = 'organisation_hierarchy'
+
+    ref = Column(Integer, primary_key=True)
+    relationship_code = Column(String(10))
+    ancestor_odscode = Column(String(50))
+    descendant_odscode = Column(String(10))
+    depth = Column(Integer)
+
+    __table_args__ = (
+        Index('ix_organisation_hierarchy_ancestor', 'relationship_code', 'ancestor_odscode', 'depth'),
+        Index('ix_organisation_hierarchy_descendant', 'relationship_code', 'descendant_odscode', 'depth'),
+    )
+
+    # Returns a printable version of the objects contents
+    def __repr__(self):
+        return "<OrganisationHierarchy(%s %s %s %s %s)>" \
+            % (
+                self.ref,
+                self.relationship_code,
+                self.ancestor_odscode,
+                self.descendant_odscode,
+                self.depth)
@@ -1,7 +1,7 @@
 import sys
 
 import os.path
-from sqlalchemy import Column, Integer, String, Date
+from sqlalchemy import Column, ForeignKey, Integer, String, Date
 
 # setup path so we can import our own models and controllers
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
@@ -18,6 +18,7 @@ class Relationship(Base):
     __tablename__ = 'relationships'
 
     ref = Column(Integer, primary_key=True)
+    organisation_ref = Column(Integer, ForeignKey('organisations.ref'), index=True)
     code = Column(String(10), index=True)
     target_odscode = Column(String(50), index=True)
     org_odscode = Column(String(10), index=True)
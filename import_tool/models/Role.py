@@ -1,7 +1,7 @@
 import sys
 
 import os.path
-from sqlalchemy import Column, Integer, String, Boolean, Date
+from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, Date
 
 # setup path so we can import our own models and controllers
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
@@ -18,6 +18,7 @@ class Role(Base):
     __tablename__ = 'roles'
 
     ref = Column(Integer, primary_key=True)
+    organisation_ref = Column(Integer, ForeignKey('organisations.ref'), index=True)
     org_odscode = Column(String(10), index=True)
     code = Column(String(10), index=True)
     primary_role = Column(Boolean)
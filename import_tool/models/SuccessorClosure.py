@@ -0,0 +1,37 @@
+import sys
+
+import os.path
+from sqlalchemy import Column, Integer, String, Boolean, Text
+
+# setup path so we can import our own models and controllers
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from import_tool.models.base import Base
+
+
+class SuccessorClosure(Base):
+    """
+    SuccessorClosure class that keeps track of the organisation each
+    organisation's chain of successors ends at, so it can be found without
+    following the chain. This class uses SQLAlchemy as an ORM
+
+    """
+    __tablename__ = 'successor_closure'
+
+    ref = Column(Integer, primary_key=True)
+    org_odscode = Column(String(10), index=True)
+    ultimate_odscode = Column(String(10), index=True)
+    depth = Column(Integer)
+    path = Column(Text)
+    cycle = Column(Boolean)
+
+    # Returns a printable version of the objects contents
+    def __repr__(self):
+        return "<SuccessorClosure(%s %s %s %s %s %s)>" \
+            % (
+                self.ref,
+                self.org_odscode,
+                self.ultimate_odscode,
+                self.depth,
+                self.path,
+                self.cycle)
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, select
+
+# setup path so we can import the import tool and the data generator
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT_PATH)
+sys.path.append(os.path.join(ROOT_PATH, 'benchmarks'))
+
+from generate_ods_data import ODSDataGenerator, write_schema_zip
+# Importing the creator adds every model's table to the metadata
+import import_tool.controller.ODSDBCreator
+from import_tool.models.base import Base
+
+# Enough organisations for several checkpoints and worker chunks, whilst keeping the imports quick
+ORGANISATIONS = 1200
+
+
+@pytest.fixture(scope='session')
+def data_files(tmp_path_factory):
+    """Generates a data file and the schema it is validated against, returning their paths"""
+    data_dir = tmp_path_factory.mktemp('data')
+    xml_file_path = str(data_dir / 'fullfile.zip')
+    schema_file_path = str(data_dir / 'ancilliary.zip')
+
+    ODSDataGenerator(ORGANISATIONS).write_zip(xml_file_path)
+    write_schema_zip(schema_file_path)
+
+    return xml_file_path, schema_file_path
+
+
+def dump_database(connection):
+    """Reads every row of every table, in primary key order, leaving out the time of the import
+
+    Parameters
+    ----------
+    connection: SQLAlchemy connection string of the database
+
+    Returns
+    -------
+    Dictionary: the rows of each table, by table name
+    """
+    engine = create_engine(connection)
+    tables = {}
+
+    try:
+        with engine.connect() as db_connection:
+            for table in Base.metadata.sorted_tables:
+                columns = [column for column in table.columns if column.name != 'import_timestamp']
+                tables[table.name] = [tuple(row) for row in db_connection.execute(
+                    select(columns).order_by(*table.primary_key.columns))]
+    finally:
+        engine.dispose()
+
+    return tables
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from import_tool.controller.ODSExportWriter import ODSExportWriter
+from import_tool.models.base import Base
+
+
+def test_rollback_after_a_failed_commit(tmp_path, monkeypatch):
+    export_dir = str(tmp_path / 'export')
+    writer = ODSExportWriter(export_dir)
+    writer.add('settings', {'key': 'schema_version', 'value': '019'})
+
+    # The third file cannot be moved into place
+    replace = os.replace
+    replaced = []
+
+    def failing_replace(source, destination):
+        if len(replaced) == 2:
+            raise OSError("No space left on device")
+
+        replace(source, destination)
+        replaced.append(destination)
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+
+    with pytest.raises(OSError, match="No space left on device"):
+        writer.commit()
+
+    writer.rollback()
+
+    assert len(writer.committed_tables) == 2
+    assert sorted(os.listdir(export_dir)) == sorted(os.path.basename(path) for path in replaced)
+
+
+def test_commit_writes_every_table(tmp_path):
+    export_dir = str(tmp_path / 'export')
+    writer = ODSExportWriter(export_dir)
+    writer.add('settings', {'key': 'schema_version', 'value': '019'})
+    writer.commit()
+
+    assert sorted(writer.committed_tables) == sorted(Base.metadata.tables)
+    assert sorted(os.listdir(export_dir)) == sorted(
+        ['%s.csv.gz' % table_name for table_name in Base.metadata.tables] +
+        ['schema.postgresql.sql', 'schema.sqlite.sql'])
@@ -0,0 +1,232 @@
+import importlib
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+
+import pytest
+
+from conftest import ORGANISATIONS, dump_database
+from import_tool.controller.ODSImportPipeline import ODSImportPipeline, build_parser, check_options, default_options
+
+
+def sqlite_connection(tmp_path, name='openods.sqlite'):
+    return 'sqlite:///%s' % (tmp_path / name)
+
+
+def default_import(tmp_path, data_files):
+    """Imports the data file as import.py does without any of the optional arguments, returning the
+    connection string of the database"""
+    xml_file_path, schema_file_path = data_files
+    connection = sqlite_connection(tmp_path, 'default.sqlite')
+
+    importlib.import_module('import').main(['-l', '-c', connection, '-x', xml_file_path, '-s', schema_file_path])
+
+    return connection
+
+
+@pytest.mark.parametrize('arguments, error', [
+    (['--loader', 'copy'], "--loader copy requires -d postgres"),
+    (['--cache_dir', 'cache', '--incremental'], "--cache_dir cannot be used with --incremental"),
+    (['--checkpoint', '0'], "--checkpoint must be at least 1"),
+    (['--resume'], "--resume requires --checkpoint"),
+    (['--checkpoint', '10', '--resume', '--incremental'], "--resume cannot be used with --incremental"),
+    (['--checkpoint', '10', '--sqlite_atomic'], "--checkpoint cannot be used with"),
+    (['--postgres_bulk_load'], "--postgres_bulk_load requires -d postgres"),
+    (['--shadow_load', '--incremental'], "--shadow_load replaces the whole database"),
+    (['-d', 'postgres', '--shadow_load'], "needs a dedicated --live_schema"),
+    (['-d', 'postgres', '--shadow_load', '--live_schema', 'public'], "needs a dedicated --live_schema"),
+    (['--export_dir', 'export', '-d', 'sqlite'], "--export_dir cannot be used with"),
+    (['--export_dir', 'export', '--normalised'], "cannot be used with --export_dir"),
+    (['-d', 'postgres', '--sqlite_fast_load'], "the --sqlite options can only be used when importing into SQLite"),
+    (['--watch_dir', 'drop', '--incremental', '-x', 'fullfile.zip'], "--watch_dir imports each file which appears"),
+    (['--watch_dir', 'drop'], "--watch_dir requires --incremental or --shadow_load"),
+    (['--poll_interval', '0'], "--poll_interval must be more than 0"),
+])
+def test_check_options_refuses(arguments, error):
+    with pytest.raises(ValueError, match=error):
+        check_options(build_parser().parse_args(arguments))
+
+
+@pytest.mark.parametrize('arguments', [
+    [],
+    ['-d', 'postgres', '--loader', 'copy', '--postgres_bulk_load', '--shadow_load', '--live_schema', 'openods'],
+    ['--shadow_load'],
+    ['--checkpoint', '100', '--resume'],
+    ['--export_dir', 'export'],
+    ['--watch_dir', 'drop', '--incremental', '--poll_interval', '0.5'],
+])
+def test_check_options_accepts(arguments):
+    check_options(build_parser().parse_args(arguments))
+
+
+def test_default_options():
+    options = default_options(dbms='postgres', incremental=True)
+
+    assert options.dbms == 'postgres'
+    assert options.incremental
+    assert options.batch_size == build_parser().parse_args([]).batch_size
+
+    with pytest.raises(ValueError, match="Unknown import option"):
+        default_options(no_such_option=True)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'stream': True, 'pipeline': True, 'extractor': 'xslt'},
+    {'stream': True, 'workers': 2, 'defer_indexes': True},
+    {'checkpoint': 250},
+    {'shadow_load': True, 'sqlite_fast_load': True},
+])
+def test_run_matches_default_import(tmp_path, data_files, options):
+    xml_file_path, schema_file_path = data_files
+    connection = sqlite_connection(tmp_path)
+
+    import_pipeline = ODSImportPipeline(default_options(local=True, connection=connection, schema=schema_file_path,
+                                                       **options))
+
+    try:
+        metrics = import_pipeline.run(xml_file_path)
+    finally:
+        import_pipeline.close()
+
+    assert metrics.report()['rows']['organisations'] == ORGANISATIONS
+    assert dump_database(connection) == dump_database(default_import(tmp_path, data_files))
+
+
+def test_main_adds_its_log_handler_once(tmp_path, data_files):
+    import_script = importlib.import_module('import')
+    pipeline_log = logging.getLogger(ODSImportPipeline.__module__)
+
+    for attempt in range(2):
+        (tmp_path / 'default.sqlite').unlink(missing_ok=True)
+        default_import(tmp_path, data_files)
+
+    assert import_script.log.handlers.count(import_script.log_handler) == 1
+    assert pipeline_log.handlers.count(import_script.log_handler) == 1
+
+
+def test_shadow_load_keeps_the_database_mode(tmp_path, data_files):
+    xml_file_path, schema_file_path = data_files
+    connection = sqlite_connection(tmp_path)
+    database_file = str(tmp_path / 'openods.sqlite')
+
+    import_pipeline = ODSImportPipeline(default_options(local=True, connection=connection, schema=schema_file_path,
+                                                       shadow_load=True))
+
+    try:
+        import_pipeline.run(xml_file_path)
+        os.chmod(database_file, 0o640)
+
+        # Each swap installs a new file in place of the last
+        import_pipeline.run(xml_file_path)
+    finally:
+        import_pipeline.close()
+
+    assert stat.S_IMODE(os.stat(database_file).st_mode) == 0o640
+    assert dump_database(connection) == dump_database(default_import(tmp_path, data_files))
+
+
+def test_run_again_in_one_process(tmp_path, data_files):
+    xml_file_path, schema_file_path = data_files
+    connection = sqlite_connection(tmp_path)
+
+    import_pipeline = ODSImportPipeline(default_options(local=True, connection=connection, schema=schema_file_path,
+                                                       incremental=True))
+
+    try:
+        import_pipeline.run(xml_file_path)
+        # The same publication again has nothing to update
+        import_pipeline.run(xml_file_path)
+    finally:
+        import_pipeline.close()
+
+    assert dump_database(connection) == dump_database(default_import(tmp_path, data_files))
+
+
+def test_resume_after_completed_import(tmp_path, data_files):
+    xml_file_path, schema_file_path = data_files
+    connection = sqlite_connection(tmp_path)
+
+    import_pipeline = ODSImportPipeline(default_options(local=True, connection=connection, schema=schema_file_path,
+                                                       checkpoint=250, resume=True))
+
+    try:
+        # With nothing to resume, everything is imported into the empty database
+        import_pipeline.run(xml_file_path)
+
+        with pytest.raises(ValueError, match="already been completed, there is nothing to resume"):
+            import_pipeline.run(xml_file_path)
+    finally:
+        import_pipeline.close()
+
+    assert dump_database(connection) == dump_database(default_import(tmp_path, data_files))
+
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.05)
+
+
+def test_watch_and_stop(tmp_path, data_files):
+    xml_file_path, schema_file_path = data_files
+    drop_dir = tmp_path / 'drop'
+    drop_dir.mkdir()
+    connection = sqlite_connection(tmp_path)
+
+    # A broken file is logged and skipped, without stopping the watch
+    (drop_dir / 'fullfile_broken.zip').write_bytes(b'not a zip file')
+
+    import_pipeline = ODSImportPipeline(default_options(local=True, connection=connection, schema=schema_file_path,
+                                                       incremental=True, watch_dir=str(drop_dir),
+                                                       poll_interval=0.05))
+    imports = []
+    run = import_pipeline.run
+
+    def counted_run(file_path):
+        try:
+            return run(file_path)
+        finally:
+            imports.append(file_path)
+
+    import_pipeline.run = counted_run
+
+    watcher = threading.Thread(target=import_pipeline.watch, args=(str(drop_dir), 'fullfile*.zip', 0.05))
+    watcher.start()
+
+    try:
+        wait_for(lambda: len(imports) == 1)
+
+        shutil.copy(xml_file_path, str(drop_dir / 'fullfile_1.zip'))
+        wait_for(lambda: len(imports) == 2)
+
+        # Files which have been tried are left alone until they change
+        time.sleep(0.5)
+        assert imports == [str(drop_dir / 'fullfile_broken.zip'), str(drop_dir / 'fullfile_1.zip')]
+    finally:
+        import_pipeline.stop()
+        watcher.join(30)
+        import_pipeline.close()
+
+    assert not watcher.is_alive()
+    assert dump_database(connection) == dump_database(default_import(tmp_path, data_files))
+
+
+def test_stop_before_watching(tmp_path, data_files):
+    xml_file_path, schema_file_path = data_files
+
+    import_pipeline = ODSImportPipeline(default_options(local=True, connection=sqlite_connection(tmp_path),
+                                                       schema=schema_file_path, incremental=True))
+    import_pipeline.stop()
+
+    # Returns at once, rather than after the poll interval
+    started = time.monotonic()
+    import_pipeline.watch(str(tmp_path), poll_interval=60)
+    import_pipeline.close()
+
+    assert time.monotonic() - started < 10
@@ -0,0 +1,47 @@
+import os
+import stat
+
+from sqlalchemy import create_engine
+
+from import_tool.controller.ODSSQLiteLoad import ODSSQLiteLoad
+
+
+def atomic_load(database_file, start_empty=False):
+    sqlite_load = ODSSQLiteLoad(create_engine('sqlite:///%s' % database_file), atomic=True,
+                                start_empty=start_empty)
+
+    with sqlite_load.engine.begin() as connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS loads (ref INTEGER PRIMARY KEY)')
+        connection.execute('INSERT INTO loads DEFAULT VALUES')
+
+    sqlite_load.finish()
+
+
+def file_mode(file_path):
+    return stat.S_IMODE(os.stat(file_path).st_mode)
+
+
+def test_atomic_load_keeps_the_database_mode(tmp_path):
+    database_file = str(tmp_path / 'openods.sqlite')
+    atomic_load(database_file)
+
+    os.chmod(database_file, 0o640)
+    atomic_load(database_file)
+    assert file_mode(database_file) == 0o640
+
+    os.chmod(database_file, 0o664)
+    atomic_load(database_file, start_empty=True)
+    assert file_mode(database_file) == 0o664
+
+
+def test_atomic_load_of_a_new_database_follows_the_umask(tmp_path):
+    database_file = str(tmp_path / 'openods.sqlite')
+    umask = os.umask(0o022)
+
+    try:
+        atomic_load(database_file)
+    finally:
+        os.umask(umask)
+
+    assert file_mode(database_file) == 0o644
+    assert not [file_name for file_name in os.listdir(str(tmp_path)) if file_name.endswith('.tmp')]
@@ -0,0 +1,38 @@
+from import_tool.controller.ODSSuccessorClosure import create_successor_closure
+
+
+def closure(successors):
+    return sorted((row['org_odscode'], row['ultimate_odscode'], row['depth'], row['path'], row['cycle'])
+                  for table_name, row in create_successor_closure(successors))
+
+
+def test_chain():
+    assert closure({'A': ['B'], 'B': ['C']}) == [
+        ('A', 'C', 2, 'A>B>C', False),
+        ('B', 'C', 1, 'B>C', False),
+    ]
+
+
+def test_shortest_route_is_kept():
+    assert closure({'A': ['B', 'C'], 'B': ['C']}) == [
+        ('A', 'C', 1, 'A>C', False),
+        ('B', 'C', 1, 'B>C', False),
+    ]
+
+
+def test_loop():
+    assert closure({'A': ['B'], 'B': ['A']}) == [
+        ('A', 'B', 1, 'A>B', True),
+        ('B', 'A', 1, 'B>A', True),
+    ]
+
+
+def test_loop_and_branch_from_one_organisation():
+    # B's first successor loops back to A, which must not stop its second being followed to D
+    assert closure({'A': ['B'], 'B': ['A', 'C'], 'C': ['D']}) == [
+        ('A', 'B', 1, 'A>B', True),
+        ('A', 'D', 3, 'A>B>C>D', False),
+        ('B', 'A', 1, 'B>A', True),
+        ('B', 'D', 2, 'B>C>D', False),
+        ('C', 'D', 1, 'C>D', False),
+    ]